@@ -0,0 +1,123 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.paginator import InvalidPage
+from django.db import close_old_connections
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+
+from api.serializers import load_related_ids
+
+
+def in_thread(func, *args, **kwargs):
+    """Выполняет синхронный код (ORM, DRF) в пуле потоков.
+
+    В отличие от sync_to_async по умолчанию, запросы не выстраиваются
+    в очередь к одному потоку: у каждого потока своё соединение с базой,
+    и независимые запросы можно выполнять одновременно. Контекст
+    запроса (метрики, маршрутизация на реплики) переходит в поток пула,
+    см. api.middleware.request_wrapper.
+    """
+    def run():
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)()
+
+
+async def dispatch(view, request, handler):
+    """Упрощённый APIView.dispatch для асинхронного обработчика."""
+    request = view.initialize_request(request)
+    view.request = request
+    view.headers = view.default_response_headers
+    try:
+        await in_thread(view.initial, request)
+        response = await handler(view, request)
+    except Exception as exc:
+        response = view.handle_exception(exc)
+    response = view.finalize_response(request, response)
+    await in_thread(response.render)
+    return response
+
+
+async def paginate(view, queryset):
+    """Страница и count выполняются параллельно."""
+    paginator, request = view.paginator, view.request
+    number = request.query_params.get(paginator.page_query_param, 1)
+    if (paginator.use_cursor(request)
+            or number in paginator.last_page_strings):
+        return await in_thread(paginator.paginate_queryset, queryset,
+                               request, view)
+    page_size = paginator.get_page_size(request)
+    django_paginator = paginator.django_paginator_class(queryset, page_size)
+    try:
+        number = int(number)
+        if number < 1:
+            raise ValueError
+    except ValueError:
+        raise NotFound(paginator.invalid_page_message.format(
+            page_number=number, message='Неверный номер страницы.'))
+    offset = (number - 1) * page_size
+    rows, django_paginator.count = await asyncio.gather(
+        in_thread(list, queryset[offset:offset + page_size]),
+        in_thread(queryset.count),
+    )
+    try:
+        paginator.page = django_paginator.page(number)
+    except InvalidPage as exc:
+        raise NotFound(paginator.invalid_page_message.format(
+            page_number=number, message=str(exc)))
+    paginator.page.object_list = rows
+    paginator.request = request
+    return rows
+
+
+async def related(request):
+    return await in_thread(load_related_ids, request.user)
+
+
+async def recipe_list(view, request):
+    queryset = await in_thread(
+        lambda: view.filter_queryset(view.get_queryset()))
+    context = view.get_serializer_context()
+    page, context['related_ids'] = await asyncio.gather(
+        paginate(view, queryset), related(request))
+    serializer = view.get_serializer_class()(page, many=True,
+                                             context=context)
+    data = await in_thread(lambda: serializer.data)
+    return view.get_paginated_response(data)
+
+
+async def recipe_detail(view, request):
+    if settings.RECIPE_DETAIL_CACHE:
+        # Ответ собирается из кэша, см. api.detail_cache.
+        return await in_thread(view.retrieve, request, **view.kwargs)
+    context = view.get_serializer_context()
+    instance, context['related_ids'] = await asyncio.gather(
+        in_thread(view.get_object), related(request))
+    serializer = view.get_serializer_class()(instance, context=context)
+    return Response(await in_thread(lambda: serializer.data))
+
+
+def async_view(viewset, actions, handler=None, **initkwargs):
+    """Асинхронное представление для ASGI.
+
+    GET обрабатывает handler, запросы к базе идут параллельно
+    в пуле потоков; без handler и для остальных методов обычное
+    представление DRF выполняется в пуле потоков целиком.
+    """
+    sync_view = viewset.as_view(actions, **initkwargs)
+
+    async def view(request, *args, **kwargs):
+        if handler is None or request.method != 'GET':
+            return await in_thread(sync_view, request, *args, **kwargs)
+        instance = viewset(action_map=actions, **initkwargs)
+        instance.args, instance.kwargs = args, kwargs
+        return await dispatch(instance, request, handler)
+
+    # csrf_exempt оборачивает функцию в синхронную, поэтому флаг
+    # выставляется вручную, как это делает DRF в APIView.as_view().
+    view.csrf_exempt = True
+    return view
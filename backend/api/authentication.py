@@ -0,0 +1,104 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from users.models import User
+
+# Поля пользователя в кэше. Пароль и счётчики не кэшируются:
+# они загружаются из базы при обращении, а save() не перезапишет
+# их устаревшими значениями.
+SNAPSHOT_FIELDS = tuple(
+    field.attname for field in User._meta.concrete_fields
+    if field.attname in ('id', 'email', 'username', 'first_name',
+                         'last_name', 'is_active', 'is_staff',
+                         'is_superuser')
+)
+
+
+def cache_key(key):
+    return 'auth-token:{}'.format(hashlib.sha256(key.encode()).hexdigest())
+
+
+class TokenCache:
+    """Снимки пользователей по токену: LRU в памяти процесса с TTL
+    или общий кэш из CACHES, если задан TOKEN_CACHE_BACKEND."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    @property
+    def shared(self):
+        alias = settings.TOKEN_CACHE_BACKEND
+        return caches[alias] if alias else None
+
+    def get(self, key):
+        key = cache_key(key)
+        if self.shared is not None:
+            return self.shared.get(key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, snapshot = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return snapshot
+
+    def set(self, key, snapshot):
+        key = cache_key(key)
+        if self.shared is not None:
+            self.shared.set(key, snapshot, settings.TOKEN_CACHE_TTL)
+            return
+        with self.lock:
+            self.entries[key] = (
+                time.monotonic() + settings.TOKEN_CACHE_TTL, snapshot)
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.TOKEN_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        keys = [cache_key(key) for key in keys]
+        if self.shared is not None:
+            self.shared.delete_many(keys)
+            return
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+
+token_cache = TokenCache()
+
+
+def invalidate_user(user_id):
+    """Сбрасывает кэш токенов пользователя."""
+    token_cache.delete(*Token.objects.filter(
+        user_id=user_id).values_list('key', flat=True))
+
+
+class CachingTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса Token + User на каждый запрос.
+
+    Кэш сбрасывается сигналами при удалении токена (выход),
+    сохранении пользователя (смена пароля, деактивация) и его удалении.
+    """
+
+    def authenticate_credentials(self, key):
+        snapshot = token_cache.get(key)
+        if snapshot is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, tuple(
+                getattr(user, name) for name in SNAPSHOT_FIELDS))
+            return user, token
+        user = User.from_db(router.db_for_read(User), SNAPSHOT_FIELDS,
+                            snapshot)
+        return user, Token(key=key, user=user)
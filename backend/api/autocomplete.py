@@ -0,0 +1,54 @@
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection
+
+from api.serializers import IngredientSerializer
+from recipes.models import Ingredient
+
+AUTOCOMPLETE_LIMIT = 20  # Максимум подсказок в ответе
+CACHED_PREFIX_LENGTH = 3  # Префиксы не длиннее этого берутся из кэша
+CACHE_TTL = 300  # Время жизни кэша в секундах
+
+
+def find_ingredients(name):
+    """Ингредиенты по префиксу, дополненные нечёткими совпадениями."""
+    ingredients = list(
+        Ingredient.objects.filter(name__istartswith=name)
+        [:AUTOCOMPLETE_LIMIT]
+    )
+    if (len(ingredients) < AUTOCOMPLETE_LIMIT
+            and connection.vendor == 'postgresql'
+            and settings.INGREDIENT_TRIGRAM_SEARCH):
+        ingredients += (
+            Ingredient.objects
+            .filter(name__trigram_similar=name)
+            .annotate(similarity=TrigramSimilarity('name', name))
+            .exclude(name__istartswith=name)
+            .order_by('-similarity', 'name')
+            [:AUTOCOMPLETE_LIMIT - len(ingredients)]
+        )
+    return IngredientSerializer(ingredients, many=True).data
+
+
+@lru_cache(maxsize=1024)
+def find_ingredients_cached(name, epoch):
+    return find_ingredients(name)
+
+
+def autocomplete(name):
+    """Подсказки ингредиентов; короткие префиксы отдаются из кэша.
+
+    Сигналы очищают кэш только в своём процессе, поэтому записи
+    дополнительно устаревают через CACHE_TTL секунд.
+    """
+    name = name.strip().lower()
+    if len(name) <= CACHED_PREFIX_LENGTH:
+        return find_ingredients_cached(name, time.monotonic() // CACHE_TTL)
+    return find_ingredients(name)
+
+
+def clear_cache():
+    find_ingredients_cached.cache_clear()
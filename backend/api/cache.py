@@ -0,0 +1,76 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date
+
+CACHE_TIMEOUT = 60 * 60  # Время жизни закэшированного ответа в секундах
+
+
+def version_key(name):
+    return f'reference-version:{name}'
+
+
+def get_version(name):
+    """Версия справочника: время его последнего изменения."""
+    return cache.get_or_set(version_key(name), time.time, timeout=None)
+
+
+def get_versions(*names):
+    """Версии нескольких справочников одним обращением к кэшу."""
+    keys = [version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    missing = {key: time.time() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump_version(name):
+    version = time.time()
+    cache.set(version_key(name), version, timeout=None)
+    return version
+
+
+class ReferenceCacheMixin:
+    """Кэширует GET-ответы справочника до изменения его версии.
+
+    Ответы отдаются с ETag и Last-Modified, на условные запросы
+    возвращается 304 без обращения к базе данных.
+    """
+
+    cache_name = None
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'GET':
+            return super().dispatch(request, *args, **kwargs)
+        version = get_version(self.cache_name)
+        key = 'reference:{}:{}:{}'.format(
+            self.cache_name, version, hashlib.md5(
+                '{}|{}'.format(request.get_full_path(),
+                               request.META.get('HTTP_ACCEPT', ''))
+                .encode()).hexdigest()
+        )
+        cached = cache.get(key)
+        if cached is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            response.render()
+            cached = (response.content, response['Content-Type'],
+                      '"{}"'.format(hashlib.md5(response.content)
+                                    .hexdigest()))
+            cache.set(key, cached, CACHE_TIMEOUT)
+        content, content_type, etag = cached
+        response = HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(version)
+        patch_cache_control(response, no_cache=True)
+        patch_vary_headers(response, ('Accept',))
+        return get_conditional_response(
+            request, etag=etag, last_modified=int(version),
+            response=response)
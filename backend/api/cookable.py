@@ -0,0 +1,352 @@
+"""Подбор рецептов по имеющимся ингредиентам.
+
+Инвертированный индекс ингредиент → рецепты хранится в памяти
+процесса. Каждому рецепту выделен номер бита; частые ингредиенты
+хранятся битсетами (int), редкие — отсортированными массивами номеров.
+Число совпавших и недостающих ингредиентов считается сразу для всех
+рецептов побитовыми счётчиками: i-й битсет счётчика хранит i-й
+разряд числа для каждого рецепта.
+"""
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from itertools import islice
+
+from django.core.cache import cache
+from django.db import connections
+
+from recipes.models import Recipe_ingredient
+
+logger = logging.getLogger(__name__)
+
+INDEX_TTL = 600  # Индекс перестраивается не реже, чем раз в столько секунд
+CHUNK_SIZE = 10000  # Размер пачки строк при построении индекса
+DENSE_RATIO = 64  # Битсетом хранится ингредиент из 1/64 рецептов и чаще
+EVENTS_KEY = 'cookable-events'  # Номер последнего изменения рецептов
+EVENT_TTL = INDEX_TTL  # Сколько секунд хранится изменение в кэше
+MAX_EVENTS = 1000  # Больше пропущенных изменений - перестройка целиком
+FULL_REBUILD = 0  # Событие «перестроить индекс целиком»
+
+
+def event_key(number):
+    return f'cookable-event:{number}'
+
+
+def last_event():
+    return cache.get(EVENTS_KEY, 0)
+
+
+def publish(recipe_id):
+    """Публикует изменение рецепта и возвращает его номер."""
+    cache.add(EVENTS_KEY, 0, timeout=None)
+    try:
+        number = cache.incr(EVENTS_KEY)
+    except ValueError:
+        # Счётчик вытеснен из кэша между add и incr.
+        cache.add(EVENTS_KEY, 0, timeout=None)
+        number = cache.incr(EVENTS_KEY)
+    cache.set(event_key(number), recipe_id, EVENT_TTL)
+    return number
+
+
+def to_bitset(slots):
+    bits = bytearray(max(slots, default=0) // 8 + 1)
+    for slot in slots:
+        bits[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+def iter_slots(bits):
+    """Номера установленных битов по возрастанию."""
+    digits = bin(bits)[:1:-1]
+    slot = digits.find('1')
+    while slot != -1:
+        yield slot
+        slot = digits.find('1', slot + 1)
+
+
+def add_bits(counter, bits):
+    """Прибавляет единицу к счётчику в позициях bits."""
+    for index, digit in enumerate(counter):
+        counter[index] = digit ^ bits
+        bits &= digit
+        if not bits:
+            return
+    counter.append(bits)
+
+
+def subtract(minuend, subtrahend, mask):
+    """Поразрядная разность счётчиков, где уменьшаемое не меньше."""
+    result = []
+    borrow = 0
+    for index, digit in enumerate(minuend):
+        other = subtrahend[index] if index < len(subtrahend) else 0
+        result.append(digit ^ other ^ borrow)
+        borrow = ((digit ^ mask) & (other | borrow)) | (other & borrow)
+    return result
+
+
+def equal_to(counter, value, bits, mask):
+    """Позиции из bits, в которых счётчик равен value."""
+    if value >> len(counter):
+        return 0
+    for index, digit in enumerate(counter):
+        bits &= digit if value >> index & 1 else digit ^ mask
+        if not bits:
+            break
+    return bits
+
+
+def set_value(counter, slot, value):
+    """Записывает value в счётчик для одного рецепта."""
+    bit = 1 << slot
+    while len(counter) < value.bit_length():
+        counter.append(0)
+    for index, digit in enumerate(counter):
+        if value >> index & 1:
+            counter[index] = digit | bit
+        elif digit & bit:
+            counter[index] = digit ^ bit
+
+
+class RecipeIngredientIndex:
+    """Инвертированный индекс рецептов по ингредиентам.
+
+    Рецепт, сохранённый в этом процессе, переиндексируется сразу,
+    а номер его изменения публикуется в общем кэше: другие процессы
+    применяют пропущенные изменения перед запросом. Если изменений
+    слишком много или они уже вытеснены из кэша, а также раз
+    в INDEX_TTL секунд индекс перестраивается целиком в фоновом
+    потоке, и до конца перестройки запросы обслуживает прежний.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.built = False
+        self.event = 0
+        self.built_at = None
+        self.slots = array('L')
+        self.slot_of = {}
+        self.postings = {}
+        self.recipes = {}
+        self.sizes = []
+
+    def ensure_fresh(self):
+        if not self.built:
+            # Первое построение ждут все потоки, а не строят одновременно.
+            with self.build_lock:
+                if not self.built:
+                    self.rebuild()
+            return
+        if time.monotonic() - self.built_at > INDEX_TTL:
+            self.rebuild_in_background()
+        last = last_event()
+        if last != self.event and not self.build_lock.locked():
+            self.catch_up(last)
+
+    def catch_up(self, last):
+        """Применяет изменения, опубликованные другими процессами."""
+        first = self.event + 1
+        numbers = range(first, last + 1)
+        if not 0 < len(numbers) <= MAX_EVENTS:
+            self.rebuild_in_background()
+            return
+        events = cache.get_many([event_key(number) for number in numbers])
+        if len(events) < len(numbers) or FULL_REBUILD in events.values():
+            self.rebuild_in_background()
+            return
+        for recipe_id in dict.fromkeys(events.values()):
+            self.apply(recipe_id)
+        with self.lock:
+            if self.event == first - 1:
+                self.event = last
+
+    def rebuild(self):
+        # Изменения, опубликованные во время чтения, применятся поверх.
+        event = last_event()
+        self.load(Recipe_ingredient.objects
+                  .order_by('recipe_id', 'ingredient_id')
+                  .values_list('recipe_id', 'ingredient_id')
+                  .distinct()
+                  .iterator(chunk_size=CHUNK_SIZE), event)
+
+    def rebuild_in_background(self):
+        if not self.build_lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.rebuild()
+            except Exception:
+                logger.exception('Не удалось перестроить индекс рецептов')
+            finally:
+                self.build_lock.release()
+                connections.close_all()
+
+        threading.Thread(target=run, name='cookable-index',
+                         daemon=True).start()
+
+    def load(self, rows, event=0):
+        """Строит индекс по парам (id рецепта, id ингредиента),
+        отсортированным по рецепту."""
+        recipes = {}
+        for recipe_id, ingredient_id in rows:
+            recipes.setdefault(recipe_id, []).append(ingredient_id)
+        slots = array('L', recipes)
+        slot_of = {recipe_id: slot for slot, recipe_id in enumerate(slots)}
+        postings = {}
+        for recipe_id, ingredient_ids in recipes.items():
+            for ingredient_id in ingredient_ids:
+                postings.setdefault(ingredient_id, array('L')).append(
+                    slot_of[recipe_id])
+        dense = len(slots) // DENSE_RATIO
+        for ingredient_id, posting in postings.items():
+            if len(posting) > dense:
+                postings[ingredient_id] = to_bitset(posting)
+        sizes = [to_bitset([slot for slot, recipe_id in enumerate(slots)
+                            if len(recipes[recipe_id]) >> digit & 1])
+                 for digit in range(max(
+                     map(len, recipes.values()), default=0).bit_length())]
+        with self.lock:
+            self.slots = slots
+            self.slot_of = slot_of
+            self.postings = postings
+            self.recipes = {pk: tuple(ingredient_ids)
+                            for pk, ingredient_ids in recipes.items()}
+            self.sizes = sizes
+            self.event = event
+            self.built = True
+            self.built_at = time.monotonic()
+
+    def update(self, recipe_id):
+        """Переиндексирует рецепт после его изменения в этом процессе
+        и сообщает об изменении остальным."""
+        number = publish(recipe_id)
+        if not self.built:
+            return
+        self.apply(recipe_id)
+        with self.lock:
+            if self.event == number - 1:
+                self.event = number
+
+    def invalidate(self):
+        """Перестроить индекс целиком во всех процессах."""
+        publish(FULL_REBUILD)
+
+    def apply(self, recipe_id):
+        ingredient_ids = tuple(sorted(set(
+            Recipe_ingredient.objects.filter(recipe=recipe_id)
+            .values_list('ingredient', flat=True))))
+        with self.lock:
+            slot = self.slot_of.get(recipe_id)
+            if slot is None:
+                if not ingredient_ids:
+                    return
+                slot = self.slot_of[recipe_id] = len(self.slots)
+                self.slots.append(recipe_id)
+            bit = 1 << slot
+            for ingredient_id in self.recipes.pop(recipe_id, ()):
+                posting = self.postings[ingredient_id]
+                if isinstance(posting, int):
+                    self.postings[ingredient_id] = posting & ~bit
+                    continue
+                index = bisect_left(posting, slot)
+                if index < len(posting) and posting[index] == slot:
+                    del posting[index]
+            for ingredient_id in ingredient_ids:
+                posting = self.postings.setdefault(ingredient_id,
+                                                   array('L'))
+                if isinstance(posting, int):
+                    self.postings[ingredient_id] = posting | bit
+                    continue
+                index = bisect_left(posting, slot)
+                if index == len(posting) or posting[index] != slot:
+                    posting.insert(index, slot)
+            if ingredient_ids:
+                self.recipes[recipe_id] = ingredient_ids
+            set_value(self.sizes, slot, len(ingredient_ids))
+
+    def rank(self, ingredient_ids):
+        """Рецепты хотя бы с одним из ингредиентов по числу недостающих."""
+        self.ensure_fresh()
+        return self.search(ingredient_ids)
+
+    def search(self, ingredient_ids):
+        """То же, что rank, без проверки актуальности индекса."""
+        with self.lock:
+            mask = (1 << len(self.slots)) - 1
+            candidates = 0
+            covered = []
+            for ingredient_id in set(ingredient_ids):
+                posting = self.postings.get(ingredient_id)
+                if not posting:
+                    continue
+                bits = posting if isinstance(posting, int) else to_bitset(
+                    posting)
+                candidates |= bits
+                add_bits(covered, bits)
+            missing = subtract(self.sizes, covered, mask)
+            return RankedRecipes(self.slots, candidates, missing,
+                                 covered, mask)
+
+
+class RankedRecipes:
+    """Ленивая последовательность пар (id рецепта, недостающих).
+
+    Сначала идут рецепты с наименьшим числом недостающих ингредиентов,
+    среди них — с наибольшим числом совпавших. Для страницы перебираются
+    только первые группы; поддерживаются срезы, нужные пагинации.
+    """
+
+    def __init__(self, slots, candidates, missing, covered, mask):
+        self.slots = slots
+        self.candidates = candidates
+        self.missing = missing
+        self.covered = covered
+        self.mask = mask
+
+    def __len__(self):
+        return popcount(self.candidates)
+
+    def groups(self):
+        left = self.candidates
+        for missing in range(1 << len(self.missing)):
+            group = equal_to(self.missing, missing, left, self.mask)
+            left ^= group
+            for covered in range((1 << len(self.covered)) - 1, 0, -1):
+                if not group:
+                    break
+                part = equal_to(self.covered, covered, group, self.mask)
+                if part:
+                    group ^= part
+                    yield missing, part
+            if not left:
+                return
+
+    def __getitem__(self, index):
+        start = index.start or 0
+        stop = len(self) if index.stop is None else index.stop
+        skip = start
+        result = []
+        for missing, part in self.groups():
+            count = popcount(part)
+            if skip >= count:
+                skip -= count
+                continue
+            need = stop - start - len(result)
+            result.extend((self.slots[slot], missing) for slot in
+                          islice(iter_slots(part), skip, skip + need))
+            skip = 0
+            if len(result) >= stop - start:
+                break
+        return result
+
+
+index = RecipeIngredientIndex()
@@ -0,0 +1,96 @@
+"""Двухуровневый кэш ответа GET /api/recipes/{id}/.
+
+Общий уровень хранит сериализованный рецепт без флагов пользователя
+и привязан к версиям рецепта, тегов, ингредиентов и автора. Уровень
+пользователя хранит только is_favorited, is_in_shopping_cart
+и is_subscribed и привязан к версии связей пользователя. Версии
+меняются сигналами в api/signals.py.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+
+from api.cache import CACHE_TIMEOUT, get_versions
+from api.metrics import registry
+from api.serializers import RELATIONS
+from recipes.models import Favorite, Recipe, Shopping_cart
+from users.models import Subscribe
+
+NO_FLAGS = {'is_favorited': False, 'is_in_shopping_cart': False,
+            'is_subscribed': False}
+
+
+def recipe_version(pk):
+    return f'recipe:{pk}'
+
+
+def author_version(pk):
+    return f'user:{pk}'
+
+
+def relations_version(pk):
+    return f'relations:{pk}'
+
+
+def record(tier, hit):
+    registry.increment(
+        'foodgram_recipe_cache_total',
+        f'tier="{tier}",result="{"hit" if hit else "miss"}"')
+
+
+def load_flags(user, pk):
+    return Recipe.objects.filter(pk=pk).annotate(
+        is_favorited=Exists(Favorite.objects.filter(
+            user=user, recipe=OuterRef('pk'))),
+        is_in_shopping_cart=Exists(Shopping_cart.objects.filter(
+            user=user, recipe=OuterRef('pk'))),
+        is_subscribed=Exists(Subscribe.objects.filter(
+            user=user, author=OuterRef('author'))),
+    ).values(*NO_FLAGS).first() or NO_FLAGS
+
+
+def shared_data(view, pk, versions):
+    """Рецепт без флагов пользователя; Http404, если его нет."""
+    key = 'recipe-detail:{}:{}'.format(pk, hashlib.md5('|'.join(
+        [*map(str, versions), view.request.build_absolute_uri('/')]
+    ).encode()).hexdigest())
+    entry = cache.get(key)
+    if entry is not None:
+        author_id, version, data = entry
+        if get_versions(author_version(author_id)) == [version]:
+            record('shared', True)
+            return data
+    record('shared', False)
+    instance = view.get_object()
+    version, = get_versions(author_version(instance.author_id))
+    context = view.get_serializer_context()
+    context['related_ids'] = {name: set() for name in RELATIONS}
+    data = view.get_serializer(instance, context=context).data
+    cache.set(key, (instance.author_id, version, data), CACHE_TIMEOUT)
+    return data
+
+
+def recipe_detail(view, pk):
+    """Данные ответа: общая часть с наложенными флагами пользователя."""
+    user = view.request.user
+    names = [recipe_version(pk), 'tags', 'ingredients']
+    if user.is_authenticated:
+        names.append(relations_version(user.pk))
+    versions = get_versions(*names)
+    data = shared_data(view, pk, versions[:3])
+    if not user.is_authenticated:
+        return data
+    key = f'recipe-flags:{user.pk}:{pk}:{versions[3]}'
+    flags = cache.get(key)
+    record('user', flags is not None)
+    if flags is None:
+        flags = load_flags(user, pk)
+        cache.set(key, flags, CACHE_TIMEOUT)
+    return {
+        **data,
+        'author': {**data['author'],
+                   'is_subscribed': flags['is_subscribed']},
+        'is_favorited': flags['is_favorited'],
+        'is_in_shopping_cart': flags['is_in_shopping_cart'],
+    }
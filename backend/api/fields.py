@@ -0,0 +1,91 @@
+import base64
+import binascii
+import hashlib
+from tempfile import SpooledTemporaryFile
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from rest_framework import serializers
+from rest_framework.fields import SkipField
+
+from recipes.images import thumbnail_name
+
+DECODE_CHUNK_SIZE = 64 * 1024  # Размер порции base64, кратный четырём
+SPOOL_MAX_SIZE = 1024 * 1024  # Больше этого картинка пишется на диск
+IMAGE_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+
+def decode_base64(data):
+    """Декодирует base64 по частям, считая sha256 содержимого."""
+    file = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    digest = hashlib.sha256()
+    for start in range(0, len(data), DECODE_CHUNK_SIZE):
+        chunk = base64.b64decode(data[start:start + DECODE_CHUNK_SIZE])
+        digest.update(chunk)
+        file.write(chunk)
+    file.seek(0)
+    return file, digest.hexdigest()
+
+
+class HashedBase64ImageField(serializers.ImageField):
+    """Картинка в base64, сохраняемая под именем из хэша содержимого.
+
+    Одинаковые картинки хранятся в одном файле: если файл с таким
+    хэшем уже есть, вместо новой загрузки возвращается его имя.
+    Вместе с картинкой возвращаются её ширина и высота для полей
+    <имя>_width и <имя>_height, поэтому поле объявляется с source='*'.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) and data.startswith('http'):
+            raise SkipField()
+        if not (isinstance(data, str) and ';base64,' in data):
+            self.fail('invalid')
+        header, data = data.split(';base64,', 1)
+        try:
+            file, digest = decode_base64(data)
+        except (binascii.Error, ValueError):
+            self.fail('invalid_image')
+        image = super().to_internal_value(
+            File(file, name=f'{digest}.{header.rpartition("/")[2]}'))
+        extension = IMAGE_EXTENSIONS.get(image.image.format)
+        if extension is None:
+            self.fail('invalid_image')
+        width, height = image.image.size
+        model_field = self.parent.Meta.model._meta.get_field(self.field_name)
+        name = model_field.generate_filename(None, f'{digest}.{extension}')
+        if not model_field.storage.exists(name):
+            image.seek(0)
+            name = File(image, name=f'{digest}.{extension}')
+        return {
+            self.field_name: name,
+            f'{self.field_name}_width': width,
+            f'{self.field_name}_height': height,
+        }
+
+
+class ThumbnailImageField(serializers.ImageField):
+    """Ссылка на превью картинки, если оно уже создано.
+
+    Вариант превью задаётся аргументом или ключом image_variant
+    в контексте сериализатора; без варианта и пока превью не создано
+    отдаётся оригинал.
+    """
+
+    def __init__(self, variant=None, **kwargs):
+        self.variant = variant
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        name = value.name
+        variant = self.variant or self.context.get('image_variant')
+        if variant and default_storage.exists(thumbnail_name(name, variant)):
+            name = thumbnail_name(name, variant)
+        url = default_storage.url(name)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
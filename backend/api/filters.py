@@ -1,29 +1,53 @@
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
-from recipes.models import Tag, Recipe
+from recipes.models import Tag, Recipe, Favorite, Shopping_cart
+from recipes.search import search_recipes
 
 
 class RecipeFilter(FilterSet):
+    """Фильтры рецептов.
+
+    Теги, избранное и список покупок проверяются подзапросами EXISTS,
+    поэтому основной запрос не размножает строки рецептов.
+    Полнотекстовый поиск ?search= сортирует результат по релевантности.
+    """
+
     tags = filters.ModelMultipleChoiceFilter(queryset=Tag.objects.all(),
                                              field_name='tags__slug',
                                              to_field_name='slug',
+                                             method='tags_filter',
                                              )
     is_in_shopping_cart = filters.BooleanFilter(
         method='is_in_shopping_cart_filter')
     is_favorited = filters.BooleanFilter(
         method='is_favorited_filter')
+    search = filters.CharFilter(method='search_filter')
 
     class Meta:
         model = Recipe
         fields = ('tags', 'author',)
 
+    def tags_filter(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag__in=value)))
+
     def is_favorited_filter(self, queryset, name, value):
         user = self.request.user
         if not (value and user.is_authenticated):
             return queryset
-        return queryset.filter(favorite_recipe__user=user)
+        return queryset.filter(Exists(Favorite.objects.filter(
+            user=user, recipe=OuterRef('pk'))))
 
     def is_in_shopping_cart_filter(self, queryset, name, value):
         user = self.request.user
         if not (value and user.is_authenticated):
             return queryset
-        return queryset.filter(shopping_recipe__user=user)
+        return queryset.filter(Exists(Shopping_cart.objects.filter(
+            user=user, recipe=OuterRef('pk'))))
+
+    def search_filter(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return search_recipes(queryset, value)
@@ -0,0 +1,379 @@
+import json
+import platform
+import time
+from collections import namedtuple
+from datetime import datetime
+from itertools import cycle
+from pathlib import Path
+from urllib.parse import urlencode, urlparse
+
+import django
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, setup_test_environment
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.cache import bump_version
+from api.pagination import encode_cursor
+from recipes.management.commands.seed_benchmark import (HEAVY_USERNAME,
+                                                        PASSWORD,
+                                                        USERNAME_PREFIX)
+from recipes.models import Ingredient, Recipe, Recipe_ingredient, Tag
+from users.models import Subscribe, User
+
+DEFAULT_OUTPUT_DIR = settings.BASE_DIR.parent / 'benchmarks'
+PNG = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFc'
+       'SJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg==')
+KEYSTROKE_NAMES = 50  # Ингредиентов, набираемых в сценариях подсказок
+KEYSTROKE_LENGTH = 6  # Сколько первых букв названия набирается
+PAGE_SIZE = 6  # Рецептов на странице в сценариях списка
+DEEP_PAGE_SHARE = 0.9  # Глубина дальней страницы от конца списка
+
+# path, data и client (клиент другого пользователя) могут быть
+# функциями, которые вызываются перед замером; teardown получает ответ
+# и убирает созданное сценарием.
+Scenario = namedtuple('Scenario', 'name method path data teardown client',
+                      defaults=(None, None, None))
+
+
+def iter_images(data):
+    """Пары (оригинал, превью) всех рецептов в ответе."""
+    if isinstance(data, dict):
+        if 'thumbnail' in data:
+            yield data['image'], data['thumbnail']
+        data = data.values()
+    if isinstance(data, (list, type({}.values()))):
+        for item in data:
+            yield from iter_images(item)
+
+
+def media_size(url):
+    if not url:
+        return 0
+    name = urlparse(url).path[len(settings.MEDIA_URL):]
+    return default_storage.size(name) if default_storage.exists(name) else 0
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет маршруты API через тестовый клиент и сохраняет '
+            'задержки и число SQL-запросов в JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--only', default='',
+                            help='Только сценарии, содержащие строку')
+        parser.add_argument('--output',
+                            help='Файл результатов, по умолчанию '
+                                 'benchmarks/<дата>.json')
+        parser.add_argument('--compare',
+                            help='Файл прошлых результатов для сравнения')
+        parser.add_argument('--max-regression', type=float, default=0.25,
+                            help='Допустимый рост медианы задержки')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        subscription = Subscribe.objects.order_by('pk').first()
+        if subscription is None or not Recipe.objects.exists():
+            raise CommandError(
+                'Сначала заполните базу: manage.py seed_benchmark')
+        self.user = subscription.user
+        self.client = self.get_client(self.user)
+
+        results = {}
+        # Запросы идут в режиме автокоммита, как на сервере: срабатывают
+        # on_commit и маршрутизация на реплики. Созданное сценарием
+        # удаляется его teardown через API, чтобы сигналы сбросили кэши.
+        for scenario in self.scenarios():
+            if options['only'] not in scenario.name:
+                continue
+            results[scenario.name] = self.measure(
+                scenario, options['iterations'], options['warmup'])
+            self.report(scenario.name, results[scenario.name])
+
+        output = options['output'] or DEFAULT_OUTPUT_DIR / (
+            datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+        self.save(output, results, options)
+        if options['compare']:
+            self.compare(options['compare'], results,
+                         options['max_regression'])
+
+    def get_client(self, user):
+        client = APIClient()
+        token, _ = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    def scenarios(self):
+        user = self.user
+        own = Recipe.objects.filter(author=user).first()
+        recipe = own or Recipe.objects.first()
+        other = Recipe.objects.exclude(favorite_recipe__user=user).exclude(
+            shopping_recipe__user=user).exclude(author=user).first()
+        author = User.objects.exclude(pk=user.pk).exclude(
+            subscribing__user=user).first()
+        tag = Tag.objects.first()
+        ingredients = list(Recipe_ingredient.objects.filter(
+            recipe=recipe).values_list('ingredient', flat=True))
+        word = recipe.name.split()[0]
+        recipe_body = {
+            'name': 'Бенчмарк', 'text': 'Текст', 'cooking_time': 10,
+            'image': PNG, 'tags': [tag.pk],
+            'ingredients': [{'id': pk, 'amount': 10} for pk in ingredients],
+        }
+
+        # Подсказки ингредиентов сравниваются со старым SearchFilter
+        # (?search=) на одинаковых префиксах, как при наборе названия.
+        names = list(Ingredient.objects.order_by('pk').values_list(
+            'name', flat=True))
+        prefixes = [name[:length]
+                    for name in names[::max(1, len(names) // KEYSTROKE_NAMES)]
+                    for length in range(1, min(len(name),
+                                               KEYSTROKE_LENGTH) + 1)]
+
+        def keystrokes(param):
+            values = cycle(prefixes)
+
+            def path():
+                # Сбрасывает кэш ответов справочника: замеряется поиск,
+                # а не отдача готового ответа.
+                bump_version('ingredients')
+                return '/api/ingredients/?' + urlencode(
+                    {param: next(values)})
+            return path
+
+        # Дальняя страница списка: ?page=N со смещением против курсора,
+        # указывающего на ту же позицию.
+        deep_page = max(1, int(
+            Recipe.objects.count() // PAGE_SIZE * DEEP_PAGE_SHARE))
+        deep_cursor = encode_cursor(
+            Recipe.objects.order_by('name', 'id').values_list(
+                'name', 'id')[(deep_page - 1) * PAGE_SIZE - 1]
+        ) if deep_page > 1 else ''
+
+        def create_recipe():
+            response = self.client.post('/api/recipes/', recipe_body,
+                                        format='json')
+            return f'/api/recipes/{response.data["id"]}/'
+
+        def delete_recipe(response):
+            self.client.delete(f'/api/recipes/{response.data["id"]}/')
+
+        # Вход, выход и смена пароля - от имени другого пользователя,
+        # чтобы не трогать токен основного клиента.
+        member = User.objects.filter(
+            username__startswith=USERNAME_PREFIX
+        ).exclude(pk=user.pk).exclude(username=HEAVY_USERNAME).last()
+        member_client = self.get_client(member)
+        member_token = Token.objects.get(user=member)
+        credentials = {'email': member.email, 'password': PASSWORD}
+
+        def login():
+            # Выход удаляет токен, поэтому перед замером входим заново.
+            response = self.client.post('/api/auth/token/login/',
+                                        credentials, format='json')
+            client = APIClient()
+            client.credentials(
+                HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+            return client
+
+        counter = iter(range(10 ** 9))
+
+        def new_user():
+            number = next(counter)
+            return {
+                'email': f'{USERNAME_PREFIX}-new{number}@example.com',
+                'username': f'{USERNAME_PREFIX}-new{number}',
+                'first_name': 'Новый', 'last_name': 'Пользователь',
+                'password': PASSWORD,
+            }
+
+        scenarios = [
+            Scenario('recipes-list', 'get',
+                     f'/api/recipes/?limit={PAGE_SIZE}'),
+            Scenario('recipes-list-filtered', 'get',
+                     f'/api/recipes/?tags={tag.slug}&is_favorited=1'),
+            Scenario('recipes-list-cursor', 'get',
+                     f'/api/recipes/?cursor=&limit={PAGE_SIZE}'),
+            Scenario('recipes-list-deep-page', 'get',
+                     f'/api/recipes/?page={deep_page}&limit={PAGE_SIZE}'),
+            Scenario('recipes-list-deep-cursor', 'get',
+                     '/api/recipes/?' + urlencode(
+                         {'cursor': deep_cursor, 'limit': PAGE_SIZE})),
+            Scenario('recipes-search', 'get',
+                     f'/api/recipes/?search={word}'),
+            Scenario('recipes-detail', 'get', f'/api/recipes/{recipe.pk}/'),
+            Scenario('recipes-feed', 'get', '/api/recipes/feed/'),
+            Scenario('recipes-cookable', 'get',
+                     '/api/recipes/cookable/?ingredients='
+                     + ','.join(map(str, ingredients))),
+            Scenario('recipes-download-shopping-cart', 'get',
+                     '/api/recipes/download_shopping_cart/'),
+            Scenario('recipes-create', 'post', '/api/recipes/', recipe_body,
+                     teardown=delete_recipe),
+            Scenario('recipes-update', 'patch', create_recipe, recipe_body,
+                     teardown=delete_recipe),
+            Scenario('recipes-delete', 'delete', create_recipe),
+            Scenario('recipes-favorite', 'post',
+                     f'/api/recipes/{other.pk}/favorite/',
+                     teardown=lambda response: self.client.delete(
+                         f'/api/recipes/{other.pk}/favorite/')),
+            Scenario('recipes-shopping-cart', 'post',
+                     f'/api/recipes/{other.pk}/shopping_cart/',
+                     teardown=lambda response: self.client.delete(
+                         f'/api/recipes/{other.pk}/shopping_cart/')),
+            Scenario('tags-list', 'get', '/api/tags/'),
+            Scenario('tags-detail', 'get', f'/api/tags/{tag.pk}/'),
+            Scenario('ingredients-list', 'get', '/api/ingredients/'),
+            Scenario('ingredients-search', 'get',
+                     '/api/ingredients/?name=ка'),
+            Scenario('ingredients-autocomplete', 'get',
+                     keystrokes('name')),
+            Scenario('ingredients-search-filter', 'get',
+                     keystrokes('search')),
+            Scenario('ingredients-detail', 'get',
+                     f'/api/ingredients/{ingredients[0]}/'),
+            Scenario('users-list', 'get', '/api/users/'),
+            Scenario('users-detail', 'get', f'/api/users/{user.pk}/'),
+            Scenario('users-me', 'get', '/api/users/me/'),
+            Scenario('users-subscriptions', 'get',
+                     '/api/users/subscriptions/?recipes_limit=3'),
+            Scenario('users-create', 'post', '/api/users/', new_user,
+                     teardown=lambda response: User.objects.filter(
+                         pk=response.data['id']).delete()),
+            Scenario('users-set-password', 'post',
+                     '/api/users/set_password/',
+                     {'current_password': PASSWORD, 'new_password': PASSWORD},
+                     client=member_client),
+            Scenario('auth-token-login', 'post', '/api/auth/token/login/',
+                     credentials),
+            Scenario('auth-token-logout', 'post', '/api/auth/token/logout/',
+                     client=login,
+                     teardown=lambda response: member_token.save()),
+        ]
+        # Лента и подписки пользователя с тысячами подписок.
+        heavy = User.objects.filter(username=HEAVY_USERNAME).first()
+        if heavy is not None:
+            client = self.get_client(heavy)
+            scenarios += [
+                Scenario('recipes-feed-heavy', 'get', '/api/recipes/feed/',
+                         client=client),
+                Scenario('users-subscriptions-heavy', 'get',
+                         '/api/users/subscriptions/?recipes_limit=3',
+                         client=client),
+            ]
+        if author is not None:
+            scenarios.append(Scenario(
+                'users-subscribe', 'post',
+                f'/api/users/{author.pk}/subscribe/',
+                teardown=lambda response: self.client.delete(
+                    f'/api/users/{author.pk}/subscribe/')))
+        return scenarios
+
+    def request(self, scenario):
+        path, data, client = (
+            value() if callable(value) else value
+            for value in (scenario.path, scenario.data, scenario.client))
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(client or self.client, scenario.method)(
+                path, data, format='json')
+            size = len(b''.join(response.streaming_content)
+                       if response.streaming else response.content)
+            elapsed = time.perf_counter() - start
+        # Журнал запросов сбрасывается следующим запросом teardown.
+        count = len(queries)
+        if scenario.teardown:
+            scenario.teardown(response)
+        return response, elapsed, count, size
+
+    def measure(self, scenario, iterations, warmup):
+        for _ in range(warmup):
+            self.request(scenario)
+        timings = []
+        statuses = set()
+        for _ in range(iterations):
+            response, elapsed, queries, size = self.request(scenario)
+            timings.append(elapsed)
+            statuses.add(response.status_code)
+        total = sum(timings)
+        # Сколько весят картинки, на которые ссылается ответ: клиент
+        # загружает либо оригиналы из image, либо превью из thumbnail.
+        images = list(iter_images(getattr(response, 'data', None)))
+        image_sizes = {
+            'image_bytes': sum(media_size(image) for image, _ in images),
+            'thumbnail_bytes': sum(media_size(thumbnail)
+                                   for _, thumbnail in images),
+        } if images else {}
+        return {
+            'method': scenario.method.upper(),
+            'status': sorted(statuses),
+            'requests': iterations,
+            'rps': round(iterations / total, 1),
+            'mean_ms': round(total / iterations * 1000, 2),
+            'p50_ms': round(percentile(timings, 0.5) * 1000, 2),
+            'p90_ms': round(percentile(timings, 0.9) * 1000, 2),
+            'p99_ms': round(percentile(timings, 0.99) * 1000, 2),
+            'queries': queries,
+            'bytes': size,
+            **image_sizes,
+        }
+
+    def report(self, name, result):
+        self.stdout.write(
+            f'{name:32} {result["status"]} p50 {result["p50_ms"]:8.2f} мс '
+            f'p99 {result["p99_ms"]:8.2f} мс {result["rps"]:8.1f} rps '
+            f'{result["queries"]:3} SQL {result["bytes"]:8} B'
+            + (f' картинки {result["image_bytes"]} B, превью '
+               f'{result["thumbnail_bytes"]} B'
+               if 'image_bytes' in result else '')
+        )
+
+    def save(self, output, results, options):
+        data = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'data': {
+                'users': User.objects.count(),
+                'recipes': Recipe.objects.count(),
+                'heavy_subscriptions': Subscribe.objects.filter(
+                    user__username=HEAVY_USERNAME).count(),
+            },
+            'results': results,
+        }
+        output = Path(output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(data, ensure_ascii=False, indent=2),
+                          encoding='utf-8')
+        self.stdout.write(self.style.SUCCESS(f'Результаты: {output}'))
+
+    def compare(self, path, results, max_regression):
+        with open(path, encoding='utf-8') as file:
+            previous = json.load(file)['results']
+        regressions = []
+        for name, result in results.items():
+            before = previous.get(name)
+            if before is None:
+                continue
+            if result['queries'] > before['queries']:
+                regressions.append(
+                    f'{name}: SQL-запросов {before["queries"]} → '
+                    f'{result["queries"]}')
+            if result['p50_ms'] > before['p50_ms'] * (1 + max_regression):
+                regressions.append(
+                    f'{name}: медиана {before["p50_ms"]} → '
+                    f'{result["p50_ms"]} мс')
+        if regressions:
+            raise CommandError('Регрессии:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
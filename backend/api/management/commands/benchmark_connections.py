@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Режимы: название, CONN_MAX_AGE, CONN_HEALTH_CHECKS.
+MODES = (
+    ('новое соединение на запрос', 0, False),
+    ('постоянное соединение', 600, False),
+    ('постоянное с проверкой', 600, True),
+)
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время запроса к базе с новым и постоянным '
+            'соединением, как между HTTP-запросами')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        settings_dict = connection.settings_dict
+        original = {key: settings_dict.get(key)
+                    for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+        try:
+            for name, max_age, health_checks in MODES:
+                settings_dict['CONN_MAX_AGE'] = max_age
+                settings_dict['CONN_HEALTH_CHECKS'] = health_checks
+                connection.close()
+                timings = sorted(
+                    self.request(connection)
+                    for _ in range(options['requests']))
+                self.stdout.write(
+                    f'{name:28} среднее '
+                    f'{sum(timings) / len(timings) * 1000:7.2f} мс, '
+                    f'p50 {timings[len(timings) // 2] * 1000:7.2f} мс, '
+                    f'p99 {timings[int(len(timings) * 0.99)] * 1000:7.2f} мс'
+                )
+        finally:
+            settings_dict.update(original)
+            connection.close()
+
+    def request(self, connection):
+        """Один запрос с сигналами начала и конца HTTP-запроса,
+        по которым Django закрывает устаревшие соединения."""
+        start = time.perf_counter()
+        request_started.send(sender=self.__class__)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+        request_finished.send(sender=self.__class__)
+        return time.perf_counter() - start
@@ -0,0 +1,63 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.cookable import RecipeIngredientIndex
+from api.management.commands.benchmark_api import percentile
+from recipes.management.commands.seed_benchmark import (popular_sample,
+                                                        popularity)
+
+PAGE_SIZE = 6  # Рецептов на странице, как в CustomPagination
+TARGET_MS = 50  # Целевая задержка подбора на странице
+
+
+class Command(BaseCommand):
+    help = ('Замеряет подбор рецептов по ингредиентам на синтетическом '
+            'индексе без базы данных')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=1000000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--min-per-recipe', type=int, default=3)
+        parser.add_argument('--max-per-recipe', type=int, default=12)
+        parser.add_argument('--have', type=int, default=10,
+                            help='Ингредиентов в запросе')
+        parser.add_argument('--queries', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        ingredients = list(range(1, options['ingredients'] + 1))
+        weights = popularity(len(ingredients))
+
+        def rows():
+            for recipe_id in range(1, options['recipes'] + 1):
+                count = random.randint(options['min_per_recipe'],
+                                       options['max_per_recipe'])
+                for ingredient_id in sorted(
+                        popular_sample(ingredients, weights, count)):
+                    yield recipe_id, ingredient_id
+
+        index = RecipeIngredientIndex()
+        start = time.perf_counter()
+        index.load(rows())
+        self.stdout.write(
+            f'Индекс: {len(index.slots)} рецептов, '
+            f'{len(index.postings)} ингредиентов за '
+            f'{time.perf_counter() - start:.1f} с')
+
+        timings = []
+        for _ in range(options['queries']):
+            have = popular_sample(ingredients, weights, options['have'])
+            start = time.perf_counter()
+            ranked = index.search(have)
+            len(ranked)
+            ranked[0:PAGE_SIZE]
+            timings.append(time.perf_counter() - start)
+        p50 = percentile(timings, 0.5) * 1000
+        p99 = percentile(timings, 0.99) * 1000
+        message = (f'Страница подбора: p50 {p50:.2f} мс, p99 {p99:.2f} мс '
+                   f'(цель {TARGET_MS} мс)')
+        style = self.style.SUCCESS if p99 <= TARGET_MS else self.style.ERROR
+        self.stdout.write(style(message))
@@ -0,0 +1,149 @@
+"""Метрики запросов к API.
+
+Для каждого запроса считаются число SQL-запросов, время в базе данных,
+время сериализации и полное время ответа. Гистограммы копятся
+по имени маршрута (например, recipes-list) в памяти процесса
+и отдаются в формате Prometheus.
+"""
+import threading
+import time
+from contextvars import ContextVar
+
+from django.http import HttpResponse
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Счётчики одного запроса; сам объект — обёртка выполнения SQL.
+
+    Под ASGI запросы одного ответа идут из нескольких потоков пула,
+    поэтому счётчики SQL меняются под блокировкой.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.queries += 1
+                self.db_time += elapsed
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        for bound, count in zip(self.buckets, self.counts):
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class Registry:
+    """Гистограммы и счётчики по маршрутам и методам."""
+
+    metrics = (
+        ('foodgram_request_seconds', 'Полное время ответа', TIME_BUCKETS),
+        ('foodgram_db_seconds', 'Время SQL-запросов', TIME_BUCKETS),
+        ('foodgram_serializer_seconds', 'Время сериализации',
+         TIME_BUCKETS),
+        ('foodgram_db_queries', 'Число SQL-запросов', QUERY_BUCKETS),
+    )
+    counters = (
+        ('foodgram_query_budget_exceeded_total',
+         'Ответы сверх бюджета запросов'),
+        ('foodgram_recipe_cache_total',
+         'Обращения к кэшу рецептов по уровням'),
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.totals = {}
+
+    def observe(self, labels, metrics, total, over_budget):
+        values = (total, metrics.db_time, metrics.serializer_time,
+                  metrics.queries)
+        with self.lock:
+            for (name, _, buckets), value in zip(self.metrics, values):
+                self.histograms.setdefault(
+                    (name, labels), Histogram(buckets)).observe(value)
+        if over_budget:
+            self.increment('foodgram_query_budget_exceeded_total', labels)
+
+    def increment(self, name, labels):
+        with self.lock:
+            self.totals[name, labels] = self.totals.get((name, labels), 0) + 1
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, description, _ in self.metrics:
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} histogram')
+                for (metric, labels), histogram in sorted(
+                        self.histograms.items()):
+                    if metric == name:
+                        lines.extend(histogram.render(name, labels))
+            for name, description in self.counters:
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} counter')
+                for (metric, labels), count in sorted(self.totals.items()):
+                    if metric == name:
+                        lines.append(f'{name}{{{labels}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class TimedSerializerMixin:
+    """Добавляет время сериализации к метрикам текущего запроса.
+
+    Учитывается только внешний вызов, вложенные сериализаторы
+    входят в его время.
+    """
+
+    def to_representation(self, instance):
+        metrics = current.get()
+        if metrics is None or metrics.depth:
+            return super().to_representation(instance)
+        metrics.depth += 1
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.depth -= 1
+            metrics.serializer_time += time.perf_counter() - start
+
+
+def metrics_view(request):
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4')
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+import time
+from functools import partial
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+from api.metrics import RequestMetrics, current, registry
+from foodgram.db.router import RoutingState, routing
+
+logger = logging.getLogger('api.metrics')
+
+
+def request_wrapper(execute, sql, params, many, context):
+    """Передаёт SQL обёрткам текущего запроса.
+
+    Ставится на каждое соединение при его открытии (api/signals.py),
+    а обёртки берутся из контекста запроса. Поэтому запросы учитываются
+    в любом потоке: в потоках пула in_thread и в потоке, где Django под
+    ASGI выполняет синхронные представления.
+    """
+    state = routing.get()
+    if state is not None and context['connection'].alias == DEFAULT_DB_ALIAS:
+        execute = partial(state, execute)
+    metrics = current.get()
+    if metrics is not None:
+        execute = partial(metrics, execute)
+    return execute(sql, params, many, context)
+
+
+class ContextMiddleware:
+    """Middleware, которое на время запроса ставит переменную контекста.
+
+    Работает и в синхронном, и в асинхронном стеке: под ASGI Django
+    не переводит его в общий поток sync_to_async, и запросы не
+    выполняются по одному.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Так Django 3.2 узнаёт асинхронный экземпляр middleware,
+            # см. django.utils.deprecation.MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.acall(request)
+        state, token = self.enter(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.variable.reset(token)
+        return self.exit(request, response, state)
+
+    async def acall(self, request):
+        state, token = self.enter(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.variable.reset(token)
+        return self.exit(request, response, state)
+
+    def enter(self, request):
+        state = self.create_state(request)
+        return state, self.variable.set(state)
+
+    def create_state(self, request):
+        raise NotImplementedError
+
+    def exit(self, request, response, state):
+        return response
+
+
+class QueryMetricsMiddleware(ContextMiddleware):
+    """Считает SQL-запросы и время ответа каждого запроса.
+
+    Результат отдаётся в заголовке Server-Timing, пишется в лог
+    одной JSON-строкой и копится в гистограммах для /metrics.
+    Запросы сверх QUERY_BUDGET логируются с уровнем WARNING.
+    Запросы из потоковых ответов выполняются уже после middleware
+    и не учитываются.
+    """
+
+    variable = current
+
+    def create_state(self, request):
+        return RequestMetrics()
+
+    def exit(self, request, response, metrics):
+        total = time.perf_counter() - metrics.start
+        match = request.resolver_match
+        endpoint = (match.url_name if match and match.url_name
+                    else 'unknown')
+        over_budget = metrics.queries > settings.QUERY_BUDGET
+        response['Server-Timing'] = (
+            f'db;dur={metrics.db_time * 1000:.1f};'
+            f'desc="{metrics.queries} queries", '
+            f'serializer;dur={metrics.serializer_time * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}'
+        )
+        registry.observe(
+            f'endpoint="{endpoint}",method="{request.method}"',
+            metrics, total, over_budget)
+        logger.log(
+            logging.WARNING if over_budget else logging.INFO,
+            json.dumps({
+                'endpoint': endpoint,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'queries': metrics.queries,
+                'db_ms': round(metrics.db_time * 1000, 1),
+                'serializer_ms': round(metrics.serializer_time * 1000, 1),
+                'total_ms': round(total * 1000, 1),
+                'over_budget': over_budget,
+            })
+        )
+        return response
+
+
+class ReplicaRoutingMiddleware(ContextMiddleware):
+    """Направляет чтение безопасных запросов к API на реплики.
+
+    После своей записи клиент получает cookie и следующие
+    DATABASE_REPLICA_STICKY секунд читает из основной базы,
+    чтобы сразу увидеть созданный рецепт или подписку.
+    """
+
+    cookie_name = 'db_primary'
+    variable = routing
+
+    def create_state(self, request):
+        return RoutingState(
+            replica=(request.method in SAFE_METHODS
+                     and request.path.startswith('/api/')
+                     and self.cookie_name not in request.COOKIES))
+
+    def exit(self, request, response, state):
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(
+                self.cookie_name, '1',
+                max_age=settings.DATABASE_REPLICA_STICKY,
+                httponly=True, samesite='Lax')
+        return response
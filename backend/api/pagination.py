@@ -1,6 +1,161 @@
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import datetime
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+COUNT_CACHE_TIMEOUT = 60  # Время жизни закэшированного count в секундах
+INVALID_CURSOR_MESSAGE = 'Неверный курсор.'
+
+
+def encode_cursor(values, reverse=False):
+    values = [value.isoformat() if isinstance(value, datetime) else value
+              for value in values]
+    return base64.urlsafe_b64encode(
+        json.dumps({'v': values, 'r': reverse}).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return data['v'], bool(data['r'])
+    except (ValueError, TypeError, KeyError):
+        raise NotFound(INVALID_CURSOR_MESSAGE)
+
+
+def reverse_ordering(ordering):
+    return [field[1:] if field.startswith('-') else f'-{field}'
+            for field in ordering]
+
+
+def keyset_filter(ordering, values):
+    """Условие «строго после values» для заданной сортировки."""
+    condition = Q()
+    for index, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        step = Q(**{f'{name}__{lookup}': values[index]})
+        for previous, value in zip(ordering[:index], values[:index]):
+            step &= Q(**{previous.lstrip('-'): value})
+        condition |= step
+    first = ordering[0]
+    bound = 'lte' if first.startswith('-') else 'gte'
+    return Q(**{f'{first.lstrip("-")}__{bound}': values[0]}) & condition
 
 
 class CustomPagination(PageNumberPagination):
+    """Постраничная пагинация с опциональным режимом курсора.
+
+    С параметром ?cursor= (пустым для первой страницы) выборка идёт
+    по ключу сортировки без OFFSET и COUNT на каждой странице.
+    """
+
     page_size_query_param = 'limit'
     page_size = 6
+    cursor_query_param = 'cursor'
+    cursor_mode = False
+
+    def use_cursor(self, request):
+        return self.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.use_cursor(request):
+            return super().paginate_queryset(queryset, request, view)
+        self.cursor_mode = True
+        self.request = request
+        page_size = self.get_page_size(request)
+        ordering = list(queryset.query.order_by
+                        or queryset.model._meta.ordering)
+        if not {'pk', 'id', '-pk', '-id'} & set(ordering):
+            ordering.append('id')
+        self.ordering = ordering
+        self.count = self.get_count(queryset)
+
+        cursor = request.query_params.get(self.cursor_query_param, '')
+        reverse = False
+        if cursor:
+            values, reverse = decode_cursor(cursor)
+            if not isinstance(values, list) or len(values) != len(ordering):
+                raise NotFound(INVALID_CURSOR_MESSAGE)
+            direction = reverse_ordering(ordering) if reverse else ordering
+            try:
+                queryset = queryset.filter(keyset_filter(direction, values))
+            except (ValueError, TypeError, ValidationError):
+                # Значения курсора не подходят к типам полей сортировки.
+                raise NotFound(INVALID_CURSOR_MESSAGE)
+        else:
+            direction = ordering
+        page = list(queryset.order_by(*direction)[:page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, bool(cursor)
+        self.cursor_page = page
+        return page
+
+    def get_count(self, queryset):
+        try:
+            sql = str(queryset.query)
+        except EmptyResultSet:
+            return 0
+        key = 'pagination-count:{}'.format(
+            hashlib.md5(sql.encode()).hexdigest())
+        return cache.get_or_set(key, queryset.count, COUNT_CACHE_TIMEOUT)
+
+    def get_cursor_link(self, item, reverse):
+        values = [getattr(item, field.lstrip('-'))
+                  for field in self.ordering]
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param,
+                                   encode_cursor(values, reverse))
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if not (self.has_next and self.cursor_page):
+            return None
+        return self.get_cursor_link(self.cursor_page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.cursor_mode:
+            return super().get_previous_link()
+        if not (self.has_previous and self.cursor_page):
+            return None
+        return self.get_cursor_link(self.cursor_page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+
+class FeedPagination(CustomPagination):
+    """Лента листается только курсором."""
+
+    def use_cursor(self, request):
+        return True
+
+
+class PagePagination(CustomPagination):
+    """Только постраничная пагинация: для последовательностей,
+    которые не являются QuerySet и не листаются курсором."""
+
+    def use_cursor(self, request):
+        return False
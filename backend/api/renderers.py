@@ -0,0 +1,61 @@
+import csv
+import json
+
+from rest_framework import renderers
+
+
+class Echo:
+    """Буфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListTextRenderer(renderers.BaseRenderer):
+    """Список покупок в виде текста."""
+
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not isinstance(data, str):
+            data = json.dumps(data, ensure_ascii=False)
+        return data.encode(self.charset)
+
+    def stream(self, ingredients):
+        yield 'Cписок покупок:\n'
+        for name, amount, unit in ingredients:
+            yield f'{name} - {amount} {unit}.\n'
+
+
+class ShoppingListCSVRenderer(ShoppingListTextRenderer):
+    """Список покупок в формате CSV."""
+
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(('name', 'amount', 'measurement_unit'))
+        for ingredient in ingredients:
+            yield writer.writerow(ingredient)
+
+
+class ShoppingListJSONRenderer(renderers.JSONRenderer):
+    """Список покупок в формате JSON."""
+
+    charset = 'utf-8'
+
+    def stream(self, ingredients):
+        yield '['
+        separator = ''
+        for name, amount, unit in ingredients:
+            yield separator + json.dumps(
+                {'name': name, 'amount': amount, 'measurement_unit': unit},
+                ensure_ascii=False
+            )
+            separator = ', '
+        yield ']'
@@ -1,25 +1,64 @@
+from django.conf import settings
 from django.db import transaction
+from django.db.models import CharField, Value
 
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from drf_base64.fields import Base64ImageField
 from rest_framework import serializers
 
+from api.fields import HashedBase64ImageField, ThumbnailImageField
+from api.metrics import TimedSerializerMixin
+from recipes.images import schedule_thumbnails
 from recipes.models import (Tag, Ingredient, Recipe, Recipe_ingredient,
-                            MIN_MEANING, MAX_MEANING)
+                            Favorite, Shopping_cart, ShoppingCartTotal,
+                            Timeline, MIN_MEANING, MAX_MEANING)
 from users.models import User, Subscribe
 
-
-class UserSerializer(UserSerializer):
+# Связи пользователя: модель и поле с id объекта.
+RELATIONS = {
+    'subscriptions': (Subscribe, 'author'),
+    'favorites': (Favorite, 'recipe'),
+    'shopping_cart': (Shopping_cart, 'recipe'),
+}
+
+
+def load_related_ids(user):
+    """id авторов и рецептов, связанных с пользователем, по связям.
+
+    Все связи загружаются одним UNION-запросом.
+    """
+    loaded = {name: set() for name in RELATIONS}
+    if not user.is_authenticated:
+        return loaded
+    queries = [
+        model.objects.filter(user=user).order_by().annotate(
+            relation=Value(name, output_field=CharField())
+        ).values_list('relation', field)
+        for name, (model, field) in RELATIONS.items()
+    ]
+    for name, pk in queries[0].union(*queries[1:], all=True):
+        loaded[name].add(pk)
+    return loaded
+
+
+def related_ids(context, relation):
+    """id, связанные с пользователем запроса; загружаются один раз
+    на сериализацию и хранятся в контексте, общем для вложенных
+    сериализаторов."""
+    request = context.get('request')
+    if request is None or not request.user.is_authenticated:
+        return frozenset()
+    if 'related_ids' not in context:
+        context['related_ids'] = load_related_ids(request.user)
+    return context['related_ids'][relation]
+
+
+class UserSerializer(TimedSerializerMixin, UserSerializer):
     """Профиль пользователя."""
 
     is_subscribed = serializers.SerializerMethodField()
 
     def get_is_subscribed(self, obj):
-        if (self.context.get('request')
-           and not self.context['request'].user.is_anonymous):
-            return Subscribe.objects.filter(user=self.context['request'].user,
-                                            author=obj).exists()
-        return False
+        return obj.pk in related_ids(self.context, 'subscriptions')
 
     class Meta:
         model = User
@@ -48,41 +87,37 @@ class UserCreateSerializer(UserCreateSerializer):
         )
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Для рецептов."""
 
     name = serializers.ReadOnlyField()
-    image = Base64ImageField(read_only=True)
+    image = serializers.ImageField(read_only=True)
+    image_width = serializers.ReadOnlyField()
+    image_height = serializers.ReadOnlyField()
+    thumbnail = ThumbnailImageField(source='image', variant='card')
     cooking_time = serializers.ReadOnlyField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_width', 'image_height',
+                  'thumbnail', 'cooking_time')
 
 
-class SubscriptionsSerializer(serializers.ModelSerializer):
+class SubscriptionsSerializer(TimedSerializerMixin,
+                              serializers.ModelSerializer):
     """Мои подписки."""
 
     is_subscribed = serializers.SerializerMethodField(read_only=True)
     recipes = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.SerializerMethodField(read_only=True)
+    recipes_count = serializers.ReadOnlyField()
 
     def get_is_subscribed(self, author):
-        request = self.context['request']
-        if request.user.is_anonymous:
-            return False
-        return author.subscribing.filter(user=request.user).exists()
-
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return author.pk in related_ids(self.context, 'subscriptions')
 
     def get_recipes(self, obj):
-        request = self.context['request']
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            recipes = recipes[:int(limit)]
-        serializer = RecipeSerializer(recipes, read_only=True, many=True)
+        # Превью загружает UserViewSet.with_recipes.
+        serializer = RecipeSerializer(obj.preview_recipes, read_only=True,
+                                      many=True, context=self.context)
         return serializer.data
 
     class Meta:
@@ -99,39 +134,14 @@ class SubscriptionsSerializer(serializers.ModelSerializer):
         )
 
 
-class SubscribeAuthorSerializer(serializers.ModelSerializer):
+class SubscribeAuthorSerializer(SubscriptionsSerializer):
     """Подписка/отписка пользователя от автора."""
 
     email = serializers.ReadOnlyField()
     username = serializers.ReadOnlyField()
-    is_subscribed = serializers.SerializerMethodField()
-    recipes = RecipeSerializer(many=True, read_only=True)
-    recipes_count = serializers.SerializerMethodField()
 
-    def get_is_subscribed(self, author):
-        request = self.context['request']
-        if request.user.is_anonymous:
-            return False
-        return author.subscribing.filter(user=request.user).exists()
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
-    class Meta:
-        model = User
-        fields = (
-            'email',
-            'id',
-            'username',
-            'first_name',
-            'last_name',
-            'is_subscribed',
-            'recipes',
-            'recipes_count'
-        )
-
-
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Список тегов."""
 
     class Meta:
@@ -139,7 +149,8 @@ class TagSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin,
+                           serializers.ModelSerializer):
     """Список ингредиентов."""
 
     class Meta:
@@ -161,7 +172,8 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'amount', 'measurement_unit')
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class RecipeReadSerializer(TimedSerializerMixin,
+                           serializers.ModelSerializer):
     """Просмотр списка рецептов."""
 
     tags = TagSerializer(many=True)
@@ -170,25 +182,32 @@ class RecipeReadSerializer(serializers.ModelSerializer):
                                              source='recipes')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
-    image = Base64ImageField()
+    # image_width и image_height относятся к оригиналу в image,
+    # превью для карточки или страницы рецепта отдаётся в thumbnail.
+    image = serializers.ImageField(read_only=True)
+    thumbnail = ThumbnailImageField(source='image')
 
     def get_is_favorited(self, recipe):
-        request = self.context['request']
-        if request.user.is_anonymous:
-            return False
-        return recipe.favorite_recipe.filter(user=request.user).exists()
+        return recipe.pk in related_ids(self.context, 'favorites')
 
     def get_is_in_shopping_cart(self, recipe):
-        request = self.context['request']
-        if not request.user.is_authenticated:
-            return False
-        return recipe.shopping_recipe.filter(user=request.user).exists()
+        return recipe.pk in related_ids(self.context, 'shopping_cart')
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart',
-                  'image', 'name', 'text', 'cooking_time')
+                  'image', 'image_width', 'image_height', 'thumbnail',
+                  'name', 'text', 'cooking_time')
+
+
+class CookableRecipeSerializer(RecipeReadSerializer):
+    """Рецепт с числом ингредиентов, которых не хватает."""
+
+    missing_ingredients = serializers.ReadOnlyField()
+
+    class Meta(RecipeReadSerializer.Meta):
+        fields = RecipeReadSerializer.Meta.fields + ('missing_ingredients',)
 
 
 class IngredientWriteSerializer(serializers.ModelSerializer):
@@ -216,22 +235,71 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
     ingredients = IngredientWriteSerializer(
         many=True
     )
-    image = Base64ImageField()
+    image = HashedBase64ImageField(source='*')
     cooking_time = serializers.IntegerField(
         max_value=MAX_MEANING, min_value=MIN_MEANING
     )
 
+    def validate_ingredients(self, ingredients):
+        ids = [ingredient['id'] for ingredient in ingredients]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError(
+                'Ингредиенты не должны повторяться.')
+        found = Ingredient.objects.in_bulk(ids)
+        missing = set(ids) - found.keys()
+        if missing:
+            raise serializers.ValidationError(
+                'Ингредиенты не найдены: {}.'.format(
+                    ', '.join(map(str, sorted(missing)))))
+        return [{'ingredient': found[ingredient['id']],
+                 'amount': ingredient['amount']}
+                for ingredient in ingredients]
+
     @transaction.atomic
     def create_ingredient(self, recipe, tags, ingredients):
         recipe.tags.set(tags)
         Recipe_ingredient.objects.bulk_create(
             [Recipe_ingredient(
                 recipe=recipe,
-                ingredient=Ingredient.objects.get(pk=ingredient['id']),
+                ingredient=ingredient['ingredient'],
                 amount=ingredient['amount']
             ) for ingredient in ingredients]
         )
 
+    def update_ingredient(self, recipe, ingredients):
+        """Изменяет только отличающиеся строки Recipe_ingredient."""
+        amounts = {ingredient['ingredient'].pk: ingredient['amount']
+                   for ingredient in ingredients}
+        deltas = dict(amounts)
+        current = {}
+        stale = []
+        for row in recipe.recipes.all():
+            deltas[row.ingredient_id] = (
+                deltas.get(row.ingredient_id, 0) - row.amount)
+            if (row.ingredient_id in amounts
+                    and row.ingredient_id not in current):
+                current[row.ingredient_id] = row
+            else:
+                stale.append(row.pk)
+        changed = []
+        for pk, row in current.items():
+            if row.amount != amounts[pk]:
+                row.amount = amounts[pk]
+                changed.append(row)
+        if stale:
+            Recipe_ingredient.objects.filter(pk__in=stale).delete()
+        Recipe_ingredient.objects.bulk_update(changed, ['amount'])
+        Recipe_ingredient.objects.bulk_create(
+            [Recipe_ingredient(
+                recipe=recipe,
+                ingredient=ingredient['ingredient'],
+                amount=ingredient['amount']
+            ) for ingredient in ingredients
+                if ingredient['ingredient'].pk not in current]
+        )
+        ShoppingCartTotal.objects.apply(
+            recipe.shopping_recipe.values_list('user', flat=True), deltas)
+
     @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
@@ -240,22 +308,28 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         recipe = Recipe.objects.create(author=request.user,
                                        **validated_data)
         self.create_ingredient(recipe, tags, ingredients)
+        if request.user.subscribers_count <= settings.FEED_FANOUT_LIMIT:
+            Timeline.objects.fan_out(recipe)
+        schedule_thumbnails(recipe.image.name)
         return recipe
 
     @transaction.atomic
     def update(self, instance, validated_data):
         instance.name = validated_data.get('name', instance.name)
         instance.text = validated_data.get('text', instance.text)
-        instance.image = validated_data.get('image', instance.image)
+        if 'image' in validated_data:
+            instance.image = validated_data['image']
+            instance.image_width = validated_data['image_width']
+            instance.image_height = validated_data['image_height']
         instance.cooking_time = validated_data.get(
             'cooking_time', instance.cooking_time)
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
-        Recipe_ingredient.objects.filter(
-            recipe=instance,
-            ingredient__in=instance.ingredients.all()).delete()
-        self.create_ingredient(instance, tags, ingredients)
+        instance.tags.set(tags)
+        self.update_ingredient(instance, ingredients)
         instance.save()
+        if 'image' in validated_data:
+            schedule_thumbnails(instance.image.name)
         return instance
 
     def to_representation(self, instance):
@@ -0,0 +1,114 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api import autocomplete, cookable
+from api.authentication import invalidate_user, token_cache
+from api.cache import bump_version
+from api.middleware import request_wrapper
+from api.detail_cache import (author_version, recipe_version,
+                              relations_version)
+from recipes.images import thumbnails_created
+from recipes.models import (Favorite, Ingredient, Recipe, Recipe_ingredient,
+                            Shopping_cart, Tag)
+from recipes.search import refresh_search_index
+from users.models import Subscribe, User
+
+
+def bump_on_commit(name):
+    # До фиксации транзакции GET прочитал бы старые строки
+    # и закэшировал их под новой версией.
+    transaction.on_commit(lambda: bump_version(name))
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def clear_ingredient_cache(signal, **kwargs):
+    transaction.on_commit(autocomplete.clear_cache)
+    bump_on_commit('ingredients')
+    if signal is post_delete:
+        transaction.on_commit(cookable.index.invalidate)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def clear_tag_cache(**kwargs):
+    bump_on_commit('tags')
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def update_recipe_search(instance, **kwargs):
+    # Ингредиенты рецепта сохраняются после самого рецепта,
+    # поэтому индекс обновляется после фиксации транзакции.
+    ids = [instance.pk]
+    transaction.on_commit(lambda: refresh_search_index(ids))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def update_cookable_index(instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: cookable.index.update(pk))
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_search(instance, created, **kwargs):
+    if created:
+        return
+    ids = list(Recipe_ingredient.objects.filter(
+        ingredient=instance).values_list('recipe', flat=True).distinct())
+    transaction.on_commit(lambda: refresh_search_index(ids))
+
+
+@receiver(post_delete, sender=Token)
+def clear_token_cache(instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: token_cache.delete(key))
+
+
+@receiver(post_save, sender=User)
+def clear_user_token_cache(instance, **kwargs):
+    # Смена пароля, деактивация и правки профиля.
+    pk = instance.pk
+    transaction.on_commit(lambda: invalidate_user(pk))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def clear_recipe_detail_cache(instance, **kwargs):
+    bump_on_commit(recipe_version(instance.pk))
+
+
+@receiver((post_save, post_delete), sender=Recipe_ingredient)
+def clear_recipe_ingredients_cache(instance, **kwargs):
+    bump_on_commit(recipe_version(instance.recipe_id))
+
+
+@receiver(thumbnails_created)
+def clear_thumbnail_recipes_cache(name, **kwargs):
+    # Превью создаются в фоне уже после сохранения рецепта, а до этого
+    # в кэше лежит ссылка на оригинал.
+    for pk in Recipe.objects.filter(image=name).values_list('pk', flat=True):
+        bump_version(recipe_version(pk))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def clear_recipe_tags_cache(instance, action, **kwargs):
+    if action.startswith('post_') and isinstance(instance, Recipe):
+        bump_on_commit(recipe_version(instance.pk))
+
+
+@receiver(post_save, sender=User)
+def clear_author_cache(instance, **kwargs):
+    bump_on_commit(author_version(instance.pk))
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=Shopping_cart)
+@receiver((post_save, post_delete), sender=Subscribe)
+def clear_user_flags_cache(instance, **kwargs):
+    bump_on_commit(relations_version(instance.user_id))
+
+
+@receiver(connection_created)
+def install_request_wrapper(connection, **kwargs):
+    if request_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(request_wrapper)
@@ -0,0 +1,1117 @@
+import asyncio
+import base64
+import json
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.core.signals import request_started
+from django.conf import settings
+from django.db import (DEFAULT_DB_ALIAS, connection, connections, router,
+                       transaction)
+from django.http import HttpResponse
+from django.test import (AsyncClient, SimpleTestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from api.async_views import in_thread
+from api.authentication import token_cache
+from api.cache import get_version
+from api.cookable import RecipeIngredientIndex, event_key, last_event
+from api.filters import RecipeFilter
+from api.metrics import RequestMetrics, current, metrics_view, registry
+from api.middleware import ReplicaRoutingMiddleware
+from api.views import RECIPES_PREVIEW_LIMIT
+from foodgram.db.base import DatabaseWrapper
+from foodgram.db.router import RoutingState, routing
+from recipes.images import (THUMBNAIL_SIZES, make_thumbnails,
+                            make_thumbnails_task, thumbnail_name)
+from recipes.models import (Favorite, Ingredient, Recipe, Recipe_ingredient,
+                            Shopping_cart, ShoppingCartTotal, Tag,
+                            Timeline)
+from recipes.search import refresh_search_index
+from users.models import Subscribe, User
+
+SLOW_VIEW_SECONDS = 0.3
+
+
+async def slow_view(request):
+    await in_thread(time.sleep, SLOW_VIEW_SECONDS)
+    return HttpResponse()
+
+
+# ROOT_URLCONF для MiddlewareConcurrencyTest.
+urlpatterns = [path('slow/', slow_view)]
+
+RECIPES_COUNT = 12  # Рецептов в тестовых данных
+PNG = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFc'
+       'SJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg==')
+
+
+class FoodgramTestCase(APITestCase):
+    """Общие тестовые данные: два пользователя, теги, ингредиенты
+    и рецепты; кэши очищаются перед каждым тестом."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com',
+            password='pass12345word')
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='pass12345word')
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {n}', color=f'#00000{n}',
+                               slug=f'tag-{n}')
+            for n in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {n}',
+                                      measurement_unit='г')
+            for n in range(10)
+        ]
+        cls.recipes = [
+            cls.create_recipe(cls.author if n % 2 else cls.user, n,
+                              cls.ingredients[:n % 5 + 1], cls.tags)
+            for n in range(RECIPES_COUNT)
+        ]
+
+    @classmethod
+    def create_recipe(cls, author, n, ingredients, tags):
+        recipe = Recipe.objects.create(
+            author=author, name=f'Рецепт {n}', text='Описание',
+            cooking_time=n + 1)
+        Recipe_ingredient.objects.bulk_create(
+            Recipe_ingredient(recipe=recipe, ingredient=ingredient,
+                              amount=10 + index)
+            for index, ingredient in enumerate(ingredients))
+        recipe.tags.set(tags)
+        return recipe
+
+    def setUp(self):
+        cache.clear()
+        token_cache.entries.clear()
+
+
+class RecipeListQueriesTest(FoodgramTestCase):
+
+    def test_query_count_does_not_depend_on_limit(self):
+        """count, страница, теги, ингредиенты и флаги пользователя."""
+        self.client.force_authenticate(self.user)
+        for limit in (2, RECIPES_COUNT):
+            with self.subTest(limit=limit), self.assertNumQueries(5):
+                response = self.client.get('/api/recipes/',
+                                           {'limit': limit})
+            self.assertEqual(len(response.data['results']), limit)
+
+
+class SubscriptionsTest(FoodgramTestCase):
+
+    def test_recipes_limit_is_validated(self):
+        self.client.force_authenticate(self.user)
+        for limit in ('-1', 'abc', '1.5'):
+            with self.subTest(limit=limit):
+                response = self.client.get('/api/users/subscriptions/',
+                                           {'recipes_limit': limit})
+                self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/users/subscriptions/',
+                                   {'recipes_limit': '0'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_preview_is_bounded_by_default(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['recipes']),
+                         RECIPES_PREVIEW_LIMIT)
+        response = self.client.get('/api/users/subscriptions/')
+        author, = response.data['results']
+        self.assertEqual(len(author['recipes']), RECIPES_PREVIEW_LIMIT)
+        response = self.client.get('/api/users/subscriptions/',
+                                   {'recipes_limit': 5})
+        author, = response.data['results']
+        self.assertEqual(len(author['recipes']), 5)
+
+
+class TimelineTest(FoodgramTestCase):
+    """Лента: рассылка при записи, дотягивание при чтении и чистка."""
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.client.force_authenticate(self.user)
+        self.author_client = self.client_class()
+        self.subscribe_url = f'/api/users/{self.author.pk}/subscribe/'
+
+    def feed_ids(self):
+        response = self.client.get('/api/recipes/feed/',
+                                   {'limit': RECIPES_COUNT * 2})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def timeline_ids(self):
+        return set(Timeline.objects.filter(user=self.user).values_list(
+            'recipe', flat=True))
+
+    def publish(self):
+        # Свежий экземпляр: число подписчиков автора изменилось в базе.
+        self.author_client.force_authenticate(
+            User.objects.get(pk=self.author.pk))
+        response = self.author_client.post('/api/recipes/', {
+            'name': 'Новый рецепт', 'text': 'Описание', 'cooking_time': 1,
+            'image': PNG, 'tags': [self.tags[0].pk],
+            'ingredients': [{'id': self.ingredients[0].pk, 'amount': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def test_subscribe_backfills_and_unsubscribe_removes(self):
+        self.assertEqual(self.feed_ids(), [])
+        self.assertEqual(self.client.post(self.subscribe_url).status_code,
+                         201)
+        self.assertEqual(self.feed_ids(), list(
+            Recipe.objects.filter(author=self.author).order_by(
+                '-pub_date', '-id').values_list('pk', flat=True)))
+        self.assertEqual(self.client.delete(self.subscribe_url).status_code,
+                         204)
+        self.assertEqual(self.timeline_ids(), set())
+        self.assertEqual(self.feed_ids(), [])
+
+    def test_new_recipe_fans_out_on_write(self):
+        self.client.post(self.subscribe_url)
+        recipe = self.publish()
+        self.assertIn(recipe, self.timeline_ids())
+        self.assertEqual(self.feed_ids()[0], recipe)
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_popular_author_is_pulled_on_read(self):
+        self.client.post(self.subscribe_url)
+        recipe = self.publish()
+        self.assertNotIn(recipe, self.timeline_ids())
+        self.assertEqual(self.feed_ids()[0], recipe)
+        self.assertIn(recipe, self.timeline_ids())
+
+    def test_recipe_delete_removes_entries(self):
+        self.client.post(self.subscribe_url)
+        recipe = self.publish()
+        self.assertEqual(
+            self.author_client.delete(f'/api/recipes/{recipe}/').status_code,
+            204)
+        self.assertNotIn(recipe, self.timeline_ids())
+        self.assertNotIn(recipe, self.feed_ids())
+
+
+class ShoppingCartTest(FoodgramTestCase):
+
+    def test_download_groups_by_ingredient_and_unit(self):
+        self.client.force_authenticate(self.user)
+        for recipe in (self.recipes[1], self.recipes[3]):
+            response = self.client.post(
+                f'/api/recipes/{recipe.pk}/shopping_cart/')
+            self.assertEqual(response.status_code, 201)
+        response = self.client.get('/api/recipes/download_shopping_cart/',
+                                   {'format': 'json'})
+        self.assertEqual(response.status_code, 200)
+        rows = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(rows, [
+            {'name': ingredient.name, 'amount': amount,
+             'measurement_unit': ingredient.measurement_unit}
+            for ingredient, amount in zip(self.ingredients,
+                                          (20, 22, 12, 13))
+        ])
+
+    def test_download_formats(self):
+        self.client.force_authenticate(self.user)
+        self.client.post(f'/api/recipes/{self.recipes[0].pk}/shopping_cart/')
+        for extension, line in (('txt', 'ингредиент 0 - 10 г.'),
+                                ('csv', 'ингредиент 0,10,г')):
+            with self.subTest(format=extension):
+                response = self.client.get(
+                    '/api/recipes/download_shopping_cart/',
+                    {'format': extension})
+                content = b''.join(response.streaming_content).decode()
+                self.assertIn(line, content)
+                self.assertEqual(
+                    response['Content-Disposition'],
+                    f'attachment; filename=shopping_list.{extension}')
+
+
+class CartTotalsTest(FoodgramTestCase):
+    """Итоги списка покупок меняются вместе с корзиной и рецептами."""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def cart(self, method, recipe):
+        return getattr(self.client, method)(
+            f'/api/recipes/{recipe.pk}/shopping_cart/')
+
+    def totals(self):
+        return dict(ShoppingCartTotal.objects.filter(
+            user=self.user, total_amount__gt=0).values_list(
+            'ingredient', 'total_amount'))
+
+    def assertTotalsMatchCart(self):
+        call_command('rebuild_cart_totals', '--check', stdout=StringIO())
+
+    def test_add_and_remove(self):
+        first, second = self.ingredients[:2]
+        self.assertEqual(self.cart('post', self.recipes[1]).status_code, 201)
+        self.assertEqual(self.cart('post', self.recipes[3]).status_code, 201)
+        self.assertEqual(self.totals()[first.pk], 20)
+        self.assertEqual(self.totals()[second.pk], 22)
+        self.assertTotalsMatchCart()
+        self.assertEqual(self.cart('delete', self.recipes[3]).status_code,
+                         204)
+        self.assertEqual(self.totals(), {first.pk: 10, second.pk: 11})
+        self.cart('delete', self.recipes[1])
+        self.assertEqual(self.totals(), {})
+        self.assertTotalsMatchCart()
+
+    def test_concurrent_add_shares_ingredient_row(self):
+        manager = ShoppingCartTotal.objects
+        bulk_create = manager.bulk_create
+
+        def racing_bulk_create(objs, **kwargs):
+            # Параллельная транзакция успела вставить ту же строку.
+            ShoppingCartTotal(user=self.user, ingredient=self.ingredients[0],
+                              total_amount=10).save()
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(manager, 'bulk_create', racing_bulk_create):
+            response = self.cart('post', self.recipes[0])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.totals(), {self.ingredients[0].pk: 20})
+
+    def test_recipe_update_changes_totals_of_carts(self):
+        recipe = self.recipes[2]  # ингредиенты 0, 1 и 2 пользователя user
+        self.cart('post', recipe)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/recipes/{recipe.pk}/', {
+                'name': recipe.name, 'text': recipe.text,
+                'cooking_time': recipe.cooking_time,
+                'tags': [self.tags[0].pk],
+                'ingredients': [
+                    {'id': self.ingredients[0].pk, 'amount': 15},
+                    {'id': self.ingredients[5].pk, 'amount': 7},
+                ],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.totals(), {self.ingredients[0].pk: 15,
+                                         self.ingredients[5].pk: 7})
+        self.assertTotalsMatchCart()
+
+    def test_recipe_delete_removes_totals(self):
+        self.cart('post', self.recipes[2])
+        self.client.delete(f'/api/recipes/{self.recipes[2].pk}/')
+        self.assertEqual(self.totals(), {})
+
+    def test_check_fails_on_drift_and_rebuild_fixes_it(self):
+        self.cart('post', self.recipes[1])
+        ShoppingCartTotal.objects.filter(user=self.user).update(
+            total_amount=1)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_cart_totals', '--check',
+                         stdout=StringIO())
+        call_command('rebuild_cart_totals', stdout=StringIO())
+        self.assertEqual(self.totals(), {self.ingredients[0].pk: 10,
+                                         self.ingredients[1].pk: 11})
+        self.assertTotalsMatchCart()
+
+
+class RecipeIngredientsTest(FoodgramTestCase):
+    """Запись ингредиентов рецепта."""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        self.recipe = self.recipes[2]  # ингредиенты 0, 1 и 2
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+
+    def payload(self, *ingredients):
+        return {
+            'name': self.recipe.name, 'text': self.recipe.text,
+            'cooking_time': self.recipe.cooking_time,
+            'tags': [self.tags[0].pk],
+            'ingredients': [{'id': pk, 'amount': amount}
+                            for pk, amount in ingredients],
+        }
+
+    def rows(self):
+        return {row.ingredient_id: (row.pk, row.amount)
+                for row in self.recipe.recipes.all()}
+
+    def test_unknown_ingredient_is_bad_request(self):
+        missing = Ingredient.objects.latest('pk').pk + 1
+        payload = self.payload((self.ingredients[0].pk, 1), (missing, 1))
+        for method, url in (('post', '/api/recipes/'),
+                            ('patch', self.url)):
+            with self.subTest(method=method):
+                response = getattr(self.client, method)(
+                    url, payload, format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(str(missing),
+                              str(response.data['ingredients']))
+        self.assertEqual(len(self.rows()), 3)
+
+    def test_update_touches_only_changed_rows(self):
+        first, second, third, added = (
+            self.ingredients[n].pk for n in (0, 1, 2, 5))
+        self.client.post(f'{self.url}shopping_cart/')
+        before = self.rows()
+        response = self.client.patch(self.url, self.payload(
+            (first, 10), (second, 20), (added, 7)), format='json')
+        self.assertEqual(response.status_code, 200)
+        after = self.rows()
+        self.assertEqual(after[first], before[first])
+        self.assertEqual(after[second], (before[second][0], 20))
+        self.assertNotIn(third, after)
+        self.assertEqual(after[added][1], 7)
+        self.assertEqual(
+            dict(ShoppingCartTotal.objects.filter(
+                user=self.user, total_amount__gt=0).values_list(
+                'ingredient', 'total_amount')),
+            {first: 10, second: 20, added: 7})
+
+
+class CountersTest(FoodgramTestCase):
+    """Денормализованные счётчики рецептов и пользователей."""
+
+    def setUp(self):
+        super().setUp()
+        # Тестовые данные создаются мимо API, счётчики выставляет сверка.
+        call_command('reconcile_counters', stdout=StringIO())
+        self.client.force_authenticate(self.user)
+
+    def counter(self, obj, field):
+        return type(obj).objects.values_list(field, flat=True).get(
+            pk=obj.pk)
+
+    def test_add_and_remove(self):
+        recipe = self.recipes[1]
+        for url, obj, field in (
+            (f'/api/recipes/{recipe.pk}/favorite/', recipe,
+             'favorites_count'),
+            (f'/api/recipes/{recipe.pk}/shopping_cart/', recipe,
+             'in_carts_count'),
+            (f'/api/users/{self.author.pk}/subscribe/', self.author,
+             'subscribers_count'),
+        ):
+            with self.subTest(field=field):
+                self.assertEqual(self.client.post(url).status_code, 201)
+                self.assertEqual(self.counter(obj, field), 1)
+                self.assertEqual(self.client.post(url).status_code, 400)
+                self.assertEqual(self.counter(obj, field), 1)
+                self.assertEqual(self.client.delete(url).status_code, 204)
+                self.assertEqual(self.counter(obj, field), 0)
+
+    def test_reconcile_fixes_drift(self):
+        recipe = self.recipes[1]
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        Recipe.objects.filter(pk=recipe.pk).update(in_carts_count=5)
+        User.objects.filter(pk=self.author.pk).update(recipes_count=0)
+        out = StringIO()
+        call_command('reconcile_counters', '--check', stdout=out)
+        self.assertIn('recipe.favorites_count: расхождений 1',
+                      out.getvalue())
+        self.assertEqual(self.counter(recipe, 'in_carts_count'), 5)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(self.counter(recipe, 'favorites_count'), 1)
+        self.assertEqual(self.counter(recipe, 'in_carts_count'), 0)
+        self.assertEqual(self.counter(self.author, 'recipes_count'),
+                         RECIPES_COUNT // 2)
+        out = StringIO()
+        call_command('reconcile_counters', '--check', stdout=out)
+        self.assertEqual({line.rsplit(' ', 1)[1]
+                          for line in out.getvalue().splitlines()}, {'0'})
+
+
+class QueryPlanTest(FoodgramTestCase):
+    """Составные индексы используются в типичных запросах.
+
+    SQLite создаёт уникальные ограничения вместе с таблицей под своими
+    именами, поэтому для них проверяются столбцы поиска по индексу.
+    """
+
+    def assertPlanContains(self, queryset, **expected):
+        if connection.vendor not in expected:
+            self.skipTest(f'План запроса для {connection.vendor}')
+        if connection.vendor == 'postgresql':
+            # На маленькой таблице планировщик выбрал бы Seq Scan.
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        self.assertIn(expected[connection.vendor], queryset.explain())
+
+    def test_relation_lookups_use_unique_indexes(self):
+        recipe = self.recipes[0]
+        for queryset, name, columns in (
+            (Favorite.objects.filter(user=self.user, recipe=recipe),
+             'unique_favorite', 'user_id=? AND recipe_id=?'),
+            (Shopping_cart.objects.filter(user=self.user, recipe=recipe),
+             'unique_shopping_cart', 'user_id=? AND recipe_id=?'),
+            (Subscribe.objects.filter(user=self.user, author=self.author),
+             'unique_subscribe', 'user_id=? AND author_id=?'),
+        ):
+            with self.subTest(index=name):
+                self.assertPlanContains(
+                    queryset, postgresql=name,
+                    sqlite=f'USING COVERING INDEX sqlite_autoindex_'
+                           f'{queryset.model._meta.db_table}_1 ({columns})')
+
+    def test_orderings_use_indexes(self):
+        for queryset, name in (
+            (Recipe.objects.order_by('name', 'id')[:6], 'recipe_name_idx'),
+            (Recipe.objects.order_by('-pub_date', '-id')[:6],
+             'recipe_pub_date_idx'),
+            (Timeline.objects.filter(user=self.user).order_by(
+                '-pub_date', '-recipe')[:6],
+             'timeline_user_date_idx'),
+            (Recipe.objects.filter(author=self.author).values('pk')[:3],
+             'recipe_author_name_idx'),
+        ):
+            with self.subTest(index=name):
+                self.assertPlanContains(queryset, postgresql=name,
+                                        sqlite=f'INDEX {name}')
+
+    def test_tag_filter_uses_tag_index(self):
+        # Без статистики SQLite выбирает уникальный индекс (recipe_id,
+        # tag_id); в рабочей базе статистику собирает ANALYZE.
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        name = 'recipes_recipe_tags_tag_recipe_idx'
+        queryset = RecipeFilter(
+            {'tags': [tag.slug for tag in self.tags[:2]]},
+            queryset=Recipe.objects.all()).qs
+        for ordered in (queryset.order_by('name')[:6], queryset):
+            with self.subTest(ordered=ordered.ordered):
+                self.assertPlanContains(
+                    ordered, postgresql=name,
+                    sqlite=f'COVERING INDEX {name} (tag_id=?')
+
+
+class ReferenceCacheTest(FoodgramTestCase):
+
+    def test_warm_cache_makes_no_queries(self):
+        for url in ('/api/tags/', f'/api/tags/{self.tags[0].pk}/',
+                    '/api/ingredients/',
+                    f'/api/ingredients/{self.ingredients[0].pk}/'):
+            with self.subTest(url=url):
+                cold = self.client.get(url)
+                with self.assertNumQueries(0):
+                    warm = self.client.get(url)
+                self.assertEqual(warm.content, cold.content)
+                with self.assertNumQueries(0):
+                    response = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=warm['ETag'])
+                self.assertEqual(response.status_code, 304)
+
+    def test_change_bumps_version(self):
+        self.client.get('/api/tags/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Новый', color='#ffffff', slug='new')
+        response = self.client.get('/api/tags/')
+        self.assertEqual(len(response.json()), len(self.tags) + 1)
+
+    def test_version_bumped_after_commit(self):
+        changes = {
+            'tags': lambda: Tag.objects.create(
+                name='Новый', color='#ffffff', slug='new'),
+            'ingredients': lambda: Ingredient.objects.create(
+                name='Новый', measurement_unit='г'),
+        }
+        for name, change in changes.items():
+            with self.subTest(name=name), mock.patch(
+                    'api.autocomplete.clear_cache') as clear_cache:
+                version = get_version(name)
+                with self.captureOnCommitCallbacks(execute=True):
+                    change()
+                    self.assertEqual(get_version(name), version)
+                    clear_cache.assert_not_called()
+                self.assertNotEqual(get_version(name), version)
+                self.assertEqual(clear_cache.called, name == 'ingredients')
+
+
+@override_settings(RECIPE_DETAIL_CACHE=True)
+class RecipeDetailCacheTest(FoodgramTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = Recipe.objects.filter(author=self.user).first()
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+
+    def test_warm_cache_makes_no_queries(self):
+        expected = self.client.get(self.url).data
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).data, expected)
+
+    def test_user_flags_and_edits(self):
+        self.client.force_authenticate(self.user)
+        self.assertFalse(self.client.get(self.url).data['is_favorited'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'{self.url}favorite/')
+            self.client.patch(self.url, {
+                'name': 'Новое имя', 'text': self.recipe.text,
+                'cooking_time': self.recipe.cooking_time,
+                'tags': [self.tags[0].pk],
+                'ingredients': [{'id': self.ingredients[0].pk,
+                                 'amount': 1}],
+            }, format='json')
+        data = self.client.get(self.url).data
+        self.assertTrue(data['is_favorited'])
+        self.assertEqual(data['name'], 'Новое имя')
+
+    @override_settings(RECIPE_DETAIL_CACHE=False)
+    def test_disabled_without_shared_cache(self):
+        self.client.get(self.url)
+        Recipe.objects.filter(pk=self.recipe.pk).update(name='Без сигналов')
+        self.assertEqual(self.client.get(self.url).data['name'],
+                         'Без сигналов')
+
+
+class CursorPaginationTest(FoodgramTestCase):
+
+    def test_pages_do_not_overlap(self):
+        names = []
+        url = '/api/recipes/?cursor=&limit=5'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            names += [recipe['name'] for recipe in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(names, sorted(recipe.name
+                                       for recipe in self.recipes))
+
+    def test_malformed_cursor_is_not_found(self):
+        for value in ('not json', '[1]', '{"v": [1]}', '{"v": ["a", "zz"]}',
+                      '{"v": ["a", null]}', '{"v": {"x": 1}}',
+                      '{"v": [[1], {}]}'):
+            cursor = base64.urlsafe_b64encode(
+                value.replace('}', ', "r": false}').encode()).decode()
+            with self.subTest(cursor=value):
+                response = self.client.get('/api/recipes/',
+                                           {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+
+class RecipeFilterTest(FoodgramTestCase):
+
+    def get_ids(self, **params):
+        response = self.client.get('/api/recipes/',
+                                   {'limit': RECIPES_COUNT * 2, **params})
+        self.assertEqual(response.status_code, 200)
+        ids = [recipe['id'] for recipe in response.data['results']]
+        self.assertEqual(response.data['count'], len(ids))
+        return ids
+
+    def test_several_tags_do_not_duplicate_recipes(self):
+        self.recipes[0].tags.set(self.tags[:1])
+        ids = self.get_ids(tags=[tag.slug for tag in self.tags])
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertCountEqual(ids, [recipe.pk for recipe in self.recipes])
+        self.assertCountEqual(
+            self.get_ids(tags=[tag.slug for tag in self.tags[1:]]),
+            [recipe.pk for recipe in self.recipes[1:]])
+
+    def test_combined_filters(self):
+        favorite, in_cart = self.recipes[1], self.recipes[3]
+        Favorite.objects.create(user=self.user, recipe=favorite)
+        Favorite.objects.create(user=self.user, recipe=in_cart)
+        Shopping_cart.objects.create(user=self.user, recipe=in_cart)
+        self.client.force_authenticate(self.user)
+        tags = [tag.slug for tag in self.tags]
+        self.assertCountEqual(
+            self.get_ids(tags=tags, is_favorited=1),
+            [favorite.pk, in_cart.pk])
+        self.assertEqual(
+            self.get_ids(tags=tags, is_favorited=1, is_in_shopping_cart=1,
+                         author=self.author.pk),
+            [in_cart.pk])
+
+
+class RecipeSearchTest(FoodgramTestCase):
+    """Полнотекстовый поиск ?search= (в тестах — FTS5 SQLite)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        lemon = Ingredient.objects.create(name='лимон',
+                                          measurement_unit='шт.')
+        cls.by_name = cls.named_recipe(cls.user, 'Пирог с лимоном',
+                                       cls.ingredients[:1], cls.tags[:1])
+        cls.by_ingredient = cls.named_recipe(cls.author, 'Чай', [lemon],
+                                             cls.tags[1:2])
+        cls.by_text = cls.named_recipe(cls.author, 'Рыба',
+                                       cls.ingredients[:1], cls.tags[1:2])
+        cls.by_text.text = 'Полейте соком лимона перед подачей.'
+        cls.by_text.save()
+        refresh_search_index()
+
+    @classmethod
+    def named_recipe(cls, author, name, ingredients, tags):
+        recipe = cls.create_recipe(author, 0, ingredients, tags)
+        recipe.name = name
+        recipe.save()
+        return recipe
+
+    def search(self, **params):
+        response = self.client.get('/api/recipes/',
+                                   {'search': 'лимон', **params})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_name_outweighs_ingredients_and_text(self):
+        self.assertEqual(self.search(), [self.by_name.pk,
+                                         self.by_ingredient.pk,
+                                         self.by_text.pk])
+
+    def test_combined_with_tags_and_author(self):
+        self.assertEqual(self.search(tags=self.tags[1].slug),
+                         [self.by_ingredient.pk, self.by_text.pk])
+        self.assertEqual(self.search(author=self.user.pk),
+                         [self.by_name.pk])
+        self.assertEqual(self.search(tags=self.tags[0].slug,
+                                     author=self.author.pk), [])
+
+    def test_cursor_pagination(self):
+        ids, url = [], '/api/recipes/?' + urlencode(
+            {'search': 'лимон', 'limit': 1, 'cursor': ''})
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['count'], 3)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, self.search())
+
+
+class RecipeImageTest(FoodgramTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/recipes/', {
+            'name': 'С картинкой', 'text': 'Описание', 'cooking_time': 1,
+            'image': PNG, 'tags': [self.tags[0].pk],
+            'ingredients': [{'id': self.ingredients[0].pk, 'amount': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.recipe = Recipe.objects.get(pk=response.data['id'])
+        make_thumbnails(self.recipe.image.name)
+
+    def test_image_is_original_with_its_size(self):
+        data = self.client.get(f'/api/recipes/{self.recipe.pk}/').data
+        self.assertTrue(data['image'].endswith(self.recipe.image.url))
+        self.assertEqual((data['image_width'], data['image_height']),
+                         (1, 1))
+        self.assertTrue(data['thumbnail'].endswith('_detail.webp'))
+
+    @override_settings(RECIPE_DETAIL_CACHE=True)
+    def test_detail_cache_sees_new_thumbnails(self):
+        name = self.recipe.image.name
+        for variant in THUMBNAIL_SIZES:
+            default_storage.delete(thumbnail_name(name, variant))
+        url = f'/api/recipes/{self.recipe.pk}/'
+        data = self.client.get(url).data
+        self.assertEqual(data['thumbnail'], data['image'])
+        make_thumbnails(name)
+        self.assertTrue(
+            self.client.get(url).data['thumbnail'].endswith('_detail.webp'))
+
+    def test_background_task_closes_connections(self):
+        name = self.recipe.image.name
+        default_storage.delete(thumbnail_name(name, 'card'))
+        with mock.patch('recipes.images.close_old_connections') as close, \
+                mock.patch('api.signals.bump_version') as bump:
+            make_thumbnails_task(name)
+        self.assertEqual(close.call_count, 2)
+        bump.assert_called_once()
+
+    def test_cards_use_card_thumbnail(self):
+        recipe, = [
+            recipe for recipe in self.client.get(
+                '/api/recipes/', {'limit': RECIPES_COUNT * 2}
+            ).data['results'] if recipe['id'] == self.recipe.pk]
+        self.assertTrue(recipe['image'].endswith(self.recipe.image.url))
+        self.assertTrue(recipe['thumbnail'].endswith('_card.webp'))
+        response = self.client.post(
+            f'/api/recipes/{self.recipe.pk}/favorite/')
+        self.assertTrue(
+            response.data['image'].endswith(self.recipe.image.url))
+        self.assertTrue(response.data['thumbnail'].endswith('_card.webp'))
+
+
+class CookableTest(FoodgramTestCase):
+
+    def test_ranked_by_missing_ingredients(self):
+        ids = ','.join(str(ingredient.pk)
+                       for ingredient in self.ingredients[:2])
+        response = self.client.get('/api/recipes/cookable/',
+                                   {'ingredients': ids, 'limit': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], RECIPES_COUNT)
+        # Сначала рецепты, где есть оба ингредиента и нет недостающих.
+        self.assertCountEqual(
+            [(recipe['name'], recipe['missing_ingredients'])
+             for recipe in response.data['results']],
+            [('Рецепт 1', 0), ('Рецепт 6', 0), ('Рецепт 11', 0)])
+
+    def test_cursor_is_ignored(self):
+        response = self.client.get('/api/recipes/cookable/',
+                                   {'ingredients': '1,2,3', 'cursor': ''})
+        self.assertEqual(response.status_code, 200)
+
+
+class CookableIndexTest(FoodgramTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.index = RecipeIngredientIndex()
+        self.index.ensure_fresh()
+        self.other = RecipeIngredientIndex()
+        self.other.ensure_fresh()
+        self.recipe = self.recipes[0]
+        self.ingredient = self.ingredients[-1]
+        Recipe_ingredient.objects.create(
+            recipe=self.recipe, ingredient=self.ingredient, amount=1)
+
+    def ranked(self, index):
+        return [pk for pk, _ in index.rank([self.ingredient.pk])[:1]]
+
+    def test_first_build(self):
+        self.assertTrue(self.index.built)
+        self.assertEqual(self.index.event, last_event())
+
+    def test_other_processes_apply_published_changes(self):
+        self.index.update(self.recipe.pk)
+        self.assertEqual(self.ranked(self.index), [self.recipe.pk])
+        with mock.patch.object(self.other, 'rebuild_in_background') as job:
+            self.assertEqual(self.ranked(self.other), [self.recipe.pk])
+        job.assert_not_called()
+        self.assertEqual(self.other.event, last_event())
+
+    def test_lost_changes_rebuild_in_background(self):
+        self.index.update(self.recipe.pk)
+        cache.delete(event_key(last_event()))
+        with mock.patch.object(self.other, 'rebuild_in_background') as job:
+            self.assertEqual(self.ranked(self.other), [])
+        job.assert_called_once_with()
+
+
+class SetPasswordTest(FoodgramTestCase):
+
+    def test_set_password(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'wrong', 'new_password': 'new-pass-4321'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': 'pass12345word',
+            'new_password': 'new-pass-4321'})
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('new-pass-4321'))
+
+
+class TokenCacheTest(FoodgramTestCase):
+    """Выход, смена пароля и деактивация сбрасывают кэш токена
+    в памяти процесса и в общем кэше."""
+
+    backends = ('', 'default')
+
+    def login(self):
+        self.token, _ = Token.objects.get_or_create(user=self.user)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(self.me(), 200)
+        self.assertIsNotNone(token_cache.get(self.token.key))
+
+    def me(self):
+        return self.client.get('/api/users/me/').status_code
+
+    def test_cached_token_makes_no_queries(self):
+        self.login()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.me(), 200)
+
+    def test_logout(self):
+        for backend in self.backends:
+            with self.subTest(backend=backend), override_settings(
+                    TOKEN_CACHE_BACKEND=backend):
+                self.login()
+                with self.captureOnCommitCallbacks(execute=True):
+                    response = self.client.post('/api/auth/token/logout/')
+                self.assertEqual(response.status_code, 204)
+                self.assertEqual(self.me(), 401)
+
+    def test_password_change(self):
+        for backend in self.backends:
+            with self.subTest(backend=backend), override_settings(
+                    TOKEN_CACHE_BACKEND=backend):
+                self.login()
+                with self.captureOnCommitCallbacks(execute=True):
+                    response = self.client.post('/api/users/set_password/', {
+                        'current_password': 'pass12345word',
+                        'new_password': 'pass12345word'})
+                self.assertEqual(response.status_code, 204)
+                self.assertIsNone(token_cache.get(self.token.key))
+
+    def test_deactivation(self):
+        for backend in self.backends:
+            with self.subTest(backend=backend), override_settings(
+                    TOKEN_CACHE_BACKEND=backend):
+                self.login()
+                user = User.objects.get(pk=self.user.pk)
+                user.is_active = False
+                with self.captureOnCommitCallbacks(execute=True):
+                    user.save()
+                self.assertEqual(self.me(), 401)
+                user.is_active = True
+                user.save()
+
+
+@override_settings(MIDDLEWARE=[*settings.MIDDLEWARE,
+                               'api.middleware.QueryMetricsMiddleware'])
+class QueryMetricsTest(FoodgramTestCase):
+    """Server-Timing, /metrics и предупреждение о бюджете запросов."""
+
+    labels = 'endpoint="tags-list",method="GET"'
+
+    def setUp(self):
+        super().setUp()
+        registry.histograms.clear()
+        registry.totals.clear()
+
+    def get_tags(self):
+        cache.clear()  # Ответ справочника не должен браться из кэша.
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/tags/')
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_server_timing_header(self):
+        response, queries = self.get_tags()
+        self.assertRegex(
+            response['Server-Timing'],
+            rf'^db;dur=\d+\.\d;desc="{queries} queries", '
+            r'serializer;dur=\d+\.\d, total;dur=\d+\.\d$')
+
+    def test_metrics_output(self):
+        _, queries = self.get_tags()
+        self.get_tags()
+        output = metrics_view(None).content.decode()
+        for line in (
+            f'foodgram_request_seconds_count{{{self.labels}}} 2',
+            f'foodgram_db_queries_bucket{{{self.labels},le="+Inf"}} 2',
+            f'foodgram_db_queries_sum{{{self.labels}}} {queries * 2}',
+        ):
+            with self.subTest(line=line):
+                self.assertIn(line, output.splitlines())
+        self.assertNotIn('foodgram_query_budget_exceeded_total{', output)
+
+    def test_over_budget_is_logged(self):
+        with self.assertLogs('api.metrics', 'INFO') as logs:
+            self.get_tags()
+            with override_settings(QUERY_BUDGET=0):
+                self.get_tags()
+        within, over = logs.records
+        self.assertEqual(within.levelname, 'INFO')
+        self.assertEqual(over.levelname, 'WARNING')
+        data = json.loads(over.getMessage())
+        self.assertEqual((data['endpoint'], data['over_budget']),
+                         ('tags-list', True))
+        self.assertIn(
+            f'foodgram_query_budget_exceeded_total{{{self.labels}}} 1',
+            metrics_view(None).content.decode().splitlines())
+
+
+class InThreadTest(TransactionTestCase):
+    """Потоки пула под ASGI получают обёртки SQL текущего запроса.
+
+    Соединение потока пула не видит транзакцию теста, поэтому здесь
+    TransactionTestCase.
+    """
+
+    def test_metrics_count_pool_queries(self):
+        metrics = RequestMetrics()
+        token = current.set(metrics)
+        try:
+            async_to_sync(in_thread)(lambda: Tag.objects.exists())
+        finally:
+            current.reset(token)
+        self.assertEqual(metrics.queries, 1)
+
+    def test_routing_sees_pool_writes(self):
+        state = RoutingState(replica=True)
+        token = routing.set(state)
+        try:
+            async_to_sync(in_thread)(
+                lambda: Tag.objects.filter(pk=0).update(name='Тег'))
+        finally:
+            routing.reset(token)
+        self.assertFalse(state.replica)
+
+
+@override_settings(ROOT_URLCONF=__name__, MIDDLEWARE=[
+    'api.middleware.QueryMetricsMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
+])
+class MiddlewareConcurrencyTest(SimpleTestCase):
+    """Под ASGI middleware не сводят запросы в один поток."""
+
+    def test_concurrent_requests_overlap(self):
+        async def run():
+            client = AsyncClient()
+            return await asyncio.gather(
+                *[client.get('/slow/') for _ in range(5)])
+
+        start = time.perf_counter()
+        responses = asyncio.run(run())
+        elapsed = time.perf_counter() - start
+        self.assertEqual({response.status_code for response in responses},
+                         {200})
+        self.assertIn('Server-Timing', responses[0])
+        self.assertLess(elapsed, SLOW_VIEW_SECONDS * 3)
+
+
+@override_settings(
+    DATABASE_ROUTERS=['foodgram.db.router.ReplicaRouter'],
+    DATABASE_REPLICAS=['replica'],
+    MIDDLEWARE=[*settings.MIDDLEWARE,
+                'api.middleware.ReplicaRoutingMiddleware'],
+)
+class ReplicaRouterTest(TransactionTestCase):
+    """Чтение с реплики: вторая база SQLite, в которой есть только теги.
+
+    TransactionTestCase, потому что внутри транзакции теста чтение
+    всегда идёт в default.
+    """
+
+    aliases = ('replica', 'broken')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for alias, name in zip(self.aliases, (
+                f'{directory.name}/replica.sqlite3',
+                f'{directory.name}/missing/broken.sqlite3')):
+            connections.databases[alias] = {
+                'ENGINE': 'django.db.backends.sqlite3', 'NAME': name}
+            self.addCleanup(self.remove_alias, alias)
+        with connections['replica'].schema_editor() as editor:
+            editor.create_model(Tag)
+        Tag.objects.using('replica').create(
+            name='С реплики', color='#000001', slug='replica')
+        Tag.objects.create(name='Из основной', color='#000002',
+                           slug='primary')
+        cache.clear()
+
+    def remove_alias(self, alias):
+        connections[alias].close()
+        del connections[alias]
+        del connections.databases[alias]
+
+    def tag_names(self):
+        cache.clear()
+        response = self.client.get('/api/tags/')
+        self.assertEqual(response.status_code, 200)
+        return [tag['name'] for tag in response.json()]
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.tag_names(), ['С реплики'])
+
+    def test_cookie_keeps_reads_on_primary_after_write(self):
+        response = self.client.post('/api/users/', {
+            'email': 'new@example.com', 'username': 'new',
+            'first_name': 'Имя', 'last_name': 'Фамилия',
+            'password': 'pass12345word'})
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(ReplicaRoutingMiddleware.cookie_name, response.cookies)
+        self.assertEqual(self.tag_names(), ['Из основной'])
+
+    def test_write_in_request_returns_reads_to_primary(self):
+        state = RoutingState(replica=True)
+        token = routing.set(state)
+        try:
+            self.assertEqual(list(Tag.objects.values_list('slug', flat=True)),
+                             ['replica'])
+            Tag.objects.filter(slug='primary').update(name='Изменён')
+            self.assertEqual(list(Tag.objects.values_list('slug', flat=True)),
+                             ['primary'])
+        finally:
+            routing.reset(token)
+
+    @override_settings(DATABASE_REPLICAS=['broken'])
+    def test_falls_back_to_primary_when_replica_is_down(self):
+        self.assertEqual(self.tag_names(), ['Из основной'])
+        self.assertEqual(self.tag_names(), ['Из основной'])
+
+    def test_atomic_block_reads_primary(self):
+        with transaction.atomic():
+            # Состояние ставится внутри блока: SQLite начинает транзакцию
+            # запросом BEGIN, который сам вернул бы чтение в default.
+            token = routing.set(RoutingState(replica=True))
+            try:
+                self.assertEqual(
+                    list(Tag.objects.values_list('slug', flat=True)),
+                    ['primary'])
+            finally:
+                routing.reset(token)
+
+    def test_writes_reach_only_default(self):
+        token = routing.set(RoutingState(replica=True))
+        try:
+            with CaptureQueriesContext(connections['replica']) as replica:
+                tag = Tag.objects.create(name='Новый', color='#000003',
+                                         slug='new')
+                tag.name = 'Новый тег'
+                tag.save()
+                Tag.objects.filter(slug='new').delete()
+            self.assertEqual(replica.captured_queries, [])
+        finally:
+            routing.reset(token)
+        self.assertEqual(router.db_for_write(Tag), DEFAULT_DB_ALIAS)
+        self.assertEqual(Tag.objects.using('replica').count(), 1)
+
+
+class HealthCheckTest(TransactionTestCase):
+    """Постоянное соединение проверяется один раз за запрос."""
+
+    def setUp(self):
+        self.wrapper = DatabaseWrapper({
+            **connection.settings_dict, 'CONN_HEALTH_CHECKS': True})
+        self.wrapper.connection = mock.Mock()
+        self.addCleanup(setattr, self.wrapper, 'connection', None)
+        patcher = mock.patch.object(self.wrapper, 'is_usable',
+                                    return_value=True)
+        self.is_usable = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_checked_once_per_request(self):
+        # Каждый вызов in_thread заканчивается close_old_connections,
+        # это не должно вызывать проверку перед следующим запросом к базе.
+        request_started.send(sender=None)
+        for _ in range(3):
+            async_to_sync(in_thread)(self.wrapper.ensure_connection)
+        self.assertEqual(self.is_usable.call_count, 1)
+        request_started.send(sender=None)
+        self.wrapper.ensure_connection()
+        self.assertEqual(self.is_usable.call_count, 2)
@@ -1,7 +1,9 @@
+from django.conf import settings
 from django.conf.urls import url
 from django.urls import include
 from rest_framework import routers
 
+from api.async_views import async_view, recipe_detail, recipe_list
 from api.views import (RecipeViewSet, IngredientViewSet,
                        TagViewSet, UserViewSet)
 
@@ -15,3 +17,31 @@ urlpatterns = [
     url('', include(router_v1.urls)),
     url(r'^auth/', include('djoser.urls.authtoken')),
 ]
+
+# Под ASGI горячие маршруты чтения обслуживаются асинхронно,
+# остальные методы тех же адресов уходят в обычные представления.
+if settings.ASYNC_VIEWS:
+    LIST = {'get': 'list', 'post': 'create'}
+    DETAIL = {'get': 'retrieve', 'put': 'update',
+              'patch': 'partial_update', 'delete': 'destroy'}
+    urlpatterns = [
+        url(r'^recipes/$', async_view(
+            RecipeViewSet, LIST, recipe_list,
+            basename='recipes', detail=False), name='recipes-list'),
+        url(r'^recipes/(?P<pk>[^/.]+)/$', async_view(
+            RecipeViewSet, DETAIL, recipe_detail,
+            basename='recipes', detail=True), name='recipes-detail'),
+        url(r'^tags/$', async_view(
+            TagViewSet, {'get': 'list'},
+            basename='tags', detail=False), name='tags-list'),
+        url(r'^tags/(?P<pk>[^/.]+)/$', async_view(
+            TagViewSet, {'get': 'retrieve'},
+            basename='tags', detail=True), name='tags-detail'),
+        url(r'^ingredients/$', async_view(
+            IngredientViewSet, {'get': 'list'},
+            basename='ingredients', detail=False), name='ingredients-list'),
+        url(r'^ingredients/(?P<pk>[^/.]+)/$', async_view(
+            IngredientViewSet, {'get': 'retrieve'},
+            basename='ingredients', detail=True),
+            name='ingredients-detail'),
+    ] + urlpatterns
@@ -1,21 +1,45 @@
-from django.db.models import Sum
-from django.shortcuts import HttpResponse, get_object_or_404
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Greatest
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
+from djoser.serializers import SetPasswordSerializer
 from rest_framework import permissions, mixins, status, viewsets, filters
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
+from api import cookable
+from api.autocomplete import autocomplete
+from api.cache import ReferenceCacheMixin
+from api.detail_cache import recipe_detail
 from api.filters import RecipeFilter
-from api.pagination import CustomPagination
+from api.pagination import (CustomPagination, FeedPagination,
+                            PagePagination)
 from api.permissions import AuthorOrReadOnly
+from api.renderers import (ShoppingListTextRenderer, ShoppingListCSVRenderer,
+                           ShoppingListJSONRenderer)
 from api.serializers import (UserSerializer, UserCreateSerializer,
                              SubscriptionsSerializer, IngredientSerializer,
                              TagSerializer, RecipeReadSerializer,
                              RecipeCreateSerializer, RecipeSerializer,
-                             SubscribeAuthorSerializer)
-from recipes.models import (Ingredient, Tag, Recipe, Recipe_ingredient)
+                             SubscribeAuthorSerializer,
+                             CookableRecipeSerializer)
+from recipes.models import (Ingredient, Tag, Recipe, Recipe_ingredient,
+                            ShoppingCartTotal, Timeline)
 from users.models import User, Subscribe
 
+CHUNK_SIZE = 2000  # Размер пачки строк при выгрузке списка покупок
+RECIPES_PREVIEW_LIMIT = 3  # Рецептов в превью автора без recipes_limit
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно изменяет денормализованный счётчик записи."""
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)})
+
 
 class UserViewSet(mixins.CreateModelMixin,
                   mixins.ListModelMixin,
@@ -30,21 +54,57 @@ class UserViewSet(mixins.CreateModelMixin,
             return UserSerializer
         return UserCreateSerializer
 
+    def with_recipes(self, queryset):
+        """Превью рецептов автора с учётом recipes_limit.
+
+        Без recipes_limit отдаётся столько рецептов, сколько показывает
+        карточка подписки на фронтенде (subscribe/ его не передаёт).
+        """
+        limit = self.request.query_params.get('recipes_limit',
+                                              RECIPES_PREVIEW_LIMIT)
+        try:
+            limit = int(limit)
+            if limit < 0:
+                raise ValueError
+        except ValueError:
+            raise ValidationError({
+                'recipes_limit': 'Укажите неотрицательное целое число.'})
+        recipes = Recipe.objects.filter(pk__in=Subquery(
+            Recipe.objects.filter(author=OuterRef('author'))
+            .values('pk')[:limit]
+        ))
+        return queryset.prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='preview_recipes')
+        )
+
     @action(detail=False, methods=['get'],
             pagination_class=None,
             permission_classes=(permissions.IsAuthenticated,))
     def me(self, request):
-        serializer = UserSerializer(request.user)
+        serializer = UserSerializer(request.user,
+                                    context={'request': request})
         return Response(serializer.data,
                         status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['post'],
+            permission_classes=(permissions.IsAuthenticated,))
+    def set_password(self, request):
+        serializer = SetPasswordSerializer(data=request.data,
+                                           context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        request.user.set_password(serializer.validated_data['new_password'])
+        request.user.save()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
     @action(detail=False, methods=['get'],
             permission_classes=(permissions.IsAuthenticated,),
             pagination_class=CustomPagination)
     def subscriptions(self, request):
         context = {'request': request}
         user = request.user
-        queryset = User.objects.filter(subscribing__user=user)
+        queryset = self.with_recipes(
+            User.objects.filter(subscribing__user=user)
+        ).order_by('id')
         pages = self.paginate_queryset(queryset)
         serializer = SubscriptionsSerializer(pages, many=True,
                                              context=context)
@@ -58,30 +118,53 @@ class UserViewSet(mixins.CreateModelMixin,
         author = get_object_or_404(User, id=kwargs['pk'])
 
         if request.method == 'POST':
+            author = self.with_recipes(
+                User.objects.filter(pk=author.pk)).get()
             serializer = SubscribeAuthorSerializer(author, data=request.data,
                                                    context=context)
             serializer.is_valid(raise_exception=True)
-            Subscribe.objects.create(user=user, author=author)
+            try:
+                with transaction.atomic():
+                    Subscribe.objects.create(user=user, author=author)
+                    change_counter(User, author.pk, 'subscribers_count', 1)
+                    Timeline.objects.backfill(user, author)
+            except IntegrityError:
+                return Response(status=status.HTTP_400_BAD_REQUEST)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
-            get_object_or_404(Subscribe, user=user, author=author).delete()
+            subscribe = get_object_or_404(Subscribe, user=user, author=author)
+            with transaction.atomic():
+                subscribe.delete()
+                change_counter(User, author.pk, 'subscribers_count', -1)
+                Timeline.objects.filter(
+                    user=user, recipe__author=author).delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ReferenceCacheMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
+    authentication_classes = ()
     permission_classes = (permissions.AllowAny,)
+    cache_name = 'ingredients'
     pagination_class = None
     filter_backends = (filters.SearchFilter, )
     search_fields = ('^name', )
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name is None:
+            return super().list(request, *args, **kwargs)
+        return Response(autocomplete(name))
+
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ReferenceCacheMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    authentication_classes = ()
     permission_classes = (permissions.AllowAny,)
+    cache_name = 'tags'
     pagination_class = None
 
 
@@ -92,11 +175,48 @@ class RecipeViewSet(viewsets.ModelViewSet):
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        if self.action not in ('list', 'retrieve', 'feed', 'cookable'):
+            return Recipe.objects.all()
+        # is_subscribed, is_favorited и is_in_shopping_cart сериализатор
+        # берёт из множеств id, загруженных один раз на запрос.
+        return Recipe.objects.select_related('author').prefetch_related(
+            'tags',
+            Prefetch('recipes',
+                     queryset=Recipe_ingredient.objects.select_related(
+                         'ingredient')),
+        )
+
     def get_serializer_class(self):
         if self.action == 'list':
             return RecipeReadSerializer
         return RecipeCreateSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        if not settings.RECIPE_DETAIL_CACHE:
+            return super().retrieve(request, *args, **kwargs)
+        return Response(recipe_detail(self, kwargs['pk']))
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['image_variant'] = (
+            'card' if self.action in ('list', 'feed', 'cookable')
+            else 'detail')
+        return context
+
+    @transaction.atomic
+    def perform_create(self, serializer):
+        serializer.save()
+        change_counter(User, self.request.user.pk, 'recipes_count', 1)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        ShoppingCartTotal.objects.apply(
+            instance.shopping_recipe.values_list('user', flat=True),
+            ShoppingCartTotal.objects.recipe_amounts(instance, sign=-1))
+        instance.delete()
+        change_counter(User, instance.author_id, 'recipes_count', -1)
+
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=(permissions.IsAuthenticated, ),
             pagination_class=CustomPagination)
@@ -109,17 +229,62 @@ class RecipeViewSet(viewsets.ModelViewSet):
         if request.method == 'POST':
             serializer = RecipeSerializer(recipe, data=data, context=context)
             serializer.is_valid(raise_exception=True)
-            if not user.favorite_user.filter(recipe=recipe).exists():
-                user.favorite_user.create(recipe=recipe)
-                return Response(serializer.data,
-                                status=status.HTTP_201_CREATED)
-            return Response(status=status.HTTP_400_BAD_REQUEST)
+            try:
+                with transaction.atomic():
+                    user.favorite_user.create(recipe=recipe)
+                    change_counter(Recipe, recipe.pk, 'favorites_count', 1)
+            except IntegrityError:
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+            return Response(serializer.data,
+                            status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
             favorite = get_object_or_404(user.favorite_user, recipe=recipe)
-            favorite.delete()
+            with transaction.atomic():
+                favorite.delete()
+                change_counter(Recipe, recipe.pk, 'favorites_count', -1)
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False,
+            permission_classes=(permissions.IsAuthenticated, ),
+            pagination_class=FeedPagination)
+    def feed(self, request):
+        user = request.user
+        Timeline.objects.pull(user)
+        entries = self.paginate_queryset(
+            Timeline.objects.filter(user=user)
+            .order_by('-pub_date', '-recipe_id'))
+        recipes = self.get_queryset().in_bulk(
+            [entry.recipe_id for entry in entries])
+        serializer = RecipeReadSerializer(
+            [recipes[entry.recipe_id] for entry in entries
+             if entry.recipe_id in recipes],
+            many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, permission_classes=(permissions.AllowAny, ),
+            pagination_class=PagePagination)
+    def cookable(self, request):
+        try:
+            ingredient_ids = [
+                int(pk) for value in request.query_params.getlist(
+                    'ingredients') for pk in value.split(',') if pk]
+        except ValueError:
+            raise ValidationError(
+                {'ingredients': 'Укажите id ингредиентов через запятую.'})
+        ranked = self.paginate_queryset(
+            cookable.index.rank(ingredient_ids))
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, missing in ranked])
+        page = []
+        for recipe_id, missing in ranked:
+            if recipe_id in recipes:
+                recipes[recipe_id].missing_ingredients = missing
+                page.append(recipes[recipe_id])
+        serializer = CookableRecipeSerializer(
+            page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=(permissions.IsAuthenticated, ),)
     def shopping_cart(self, request, **kwargs):
@@ -131,34 +296,47 @@ class RecipeViewSet(viewsets.ModelViewSet):
         if request.method == 'POST':
             serializer = RecipeSerializer(recipe, data=data, context=context)
             serializer.is_valid(raise_exception=True)
-            if not user.shopping_user.filter(recipe=recipe).exists():
-                user.shopping_user.create(recipe=recipe)
-                return Response(serializer.data,
-                                status=status.HTTP_201_CREATED)
-            return Response(status=status.HTTP_400_BAD_REQUEST)
+            try:
+                with transaction.atomic():
+                    user.shopping_user.create(recipe=recipe)
+                    change_counter(Recipe, recipe.pk, 'in_carts_count', 1)
+                    ShoppingCartTotal.objects.apply(
+                        [user.id],
+                        ShoppingCartTotal.objects.recipe_amounts(recipe))
+            except IntegrityError:
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+            return Response(serializer.data,
+                            status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
             shoppingcart = get_object_or_404(user.shopping_user, recipe=recipe)
-            shoppingcart.delete()
+            with transaction.atomic():
+                shoppingcart.delete()
+                change_counter(Recipe, recipe.pk, 'in_carts_count', -1)
+                ShoppingCartTotal.objects.apply(
+                    [user.id],
+                    ShoppingCartTotal.objects.recipe_amounts(recipe, sign=-1))
             return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False, methods=['get'],
-            permission_classes=(permissions.IsAuthenticated, ),)
+            permission_classes=(permissions.IsAuthenticated, ),
+            renderer_classes=(ShoppingListTextRenderer,
+                              ShoppingListCSVRenderer,
+                              ShoppingListJSONRenderer))
     def download_shopping_cart(self, request, **kwargs):
         ingredients = (
-            Recipe_ingredient.objects
-            .filter(recipe__shopping_recipe__user=request.user)
+            ShoppingCartTotal.objects
+            .filter(user=request.user, total_amount__gt=0)
             .order_by('ingredient__name')
-            .annotate(total_amount=Sum('amount'))
             .values_list('ingredient__name', 'total_amount',
                          'ingredient__measurement_unit')
         )
-        shopping_list = []
-        [shopping_list.append(
-            '{} - {} {}.'.format(*ingredient)) for ingredient in ingredients]
-        response = HttpResponse('Cписок покупок:\n' + '\n'.join(shopping_list),
-                                content_type='text/plain')
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator(chunk_size=CHUNK_SIZE)),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
         response['Content-Disposition'] = (
-            'attachment; filename=shopping_list.txt'
+            f'attachment; filename=shopping_list.{renderer.format}'
         )
         return response
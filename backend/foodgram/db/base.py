@@ -0,0 +1,43 @@
+from contextvars import ContextVar
+
+from django.core.signals import request_started
+from django.db.backends.postgresql import base
+
+# Метка текущего запроса. Под ASGI она переходит из обработчика
+# в потоки пула вместе с контекстом, поэтому соединение каждого потока
+# проверяется один раз за запрос, а не после каждого close_old_connections.
+current_request = ContextVar('current_request', default=None)
+
+
+def start_request(**kwargs):
+    current_request.set(object())
+
+
+request_started.connect(start_request, dispatch_uid='foodgram.db.request')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL с проверкой постоянных соединений.
+
+    С CONN_HEALTH_CHECKS соединение, оставшееся от прошлого запроса,
+    проверяется перед первым использованием в новом запросе, и разорванное
+    (перезапуск базы, таймаут pgbouncer) открывается заново вместо ошибки.
+    В Django 3.2 этой настройки ещё нет.
+    """
+
+    checked_request = None
+
+    def connect(self):
+        super().connect()
+        self.checked_request = current_request.get()
+
+    def ensure_connection(self):
+        request = current_request.get()
+        if (self.connection is not None
+                and self.checked_request is not request
+                and self.settings_dict.get('CONN_HEALTH_CHECKS')
+                and not self.in_atomic_block):
+            self.checked_request = request
+            if not self.is_usable():
+                self.close()
+        super().ensure_connection()
@@ -0,0 +1,77 @@
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+# Состояние маршрутизации текущего запроса; вне HTTP-запросов
+# (команды, сигналы после ответа) всё идёт в основную базу.
+routing = ContextVar('db_routing', default=None)
+
+
+class RoutingState:
+    """Чтение с реплики разрешено, пока в запросе не было записи.
+
+    Экземпляр ставится обёрткой выполнения SQL на основную базу и
+    замечает любой запрос, кроме SELECT: db_for_write роутера для
+    этого не подходит, Django вызывает его и при присваивании
+    связанных объектов.
+    """
+
+    def __init__(self, replica):
+        self.replica = replica
+        self.alias = None
+
+    def __call__(self, execute, sql, params, many, context):
+        if not sql.lstrip()[:6].upper() == 'SELECT':
+            self.replica = False
+        return execute(sql, params, many, context)
+
+
+class ReplicaRouter:
+    """Чтение безопасных запросов API с реплик, запись в default.
+
+    После записи в рамках запроса чтение возвращается на default,
+    внутри транзакции default тоже читается из default. Недоступная
+    реплика исключается на DATABASE_REPLICA_RETRY секунд.
+    """
+
+    def __init__(self):
+        self.down_until = {}
+
+    def healthy(self, alias):
+        if self.down_until.get(alias, 0) > time.monotonic():
+            return False
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError:
+            self.down_until[alias] = (
+                time.monotonic() + settings.DATABASE_REPLICA_RETRY)
+            return False
+        return True
+
+    def db_for_read(self, model, **hints):
+        state = routing.get()
+        if (state is None or not state.replica
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        if state.alias is None:
+            replicas = [alias for alias in settings.DATABASE_REPLICAS
+                        if self.healthy(alias)]
+            state.alias = (random.choice(replicas) if replicas
+                           else DEFAULT_DB_ALIAS)
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if {obj1._state.db, obj2._state.db} <= databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Реплики получают схему репликацией из default.
+        return db not in settings.DATABASE_REPLICAS
@@ -19,6 +19,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'django_filters',
     'rest_framework',
     'rest_framework.authtoken',
@@ -38,6 +39,28 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Метрики SQL-запросов и времени ответа: заголовок Server-Timing,
+# логи и /metrics в формате Prometheus.
+QUERY_METRICS = os.getenv('QUERY_METRICS', 'false').lower() == 'true'
+QUERY_BUDGET = int(os.getenv('QUERY_BUDGET', 20))
+if QUERY_METRICS:
+    MIDDLEWARE.insert(0, 'api.middleware.QueryMetricsMiddleware')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.metrics': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 ROOT_URLCONF = 'foodgram.urls'
 
 TEMPLATES = [
@@ -67,17 +90,94 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 # }
 
 # Использование PG для взрослого запуска.
+# DB_CONN_MAX_AGE - сколько секунд держать соединение между запросами
+# (0 - закрывать после каждого), DB_CONN_HEALTH_CHECKS - проверять
+# переиспользуемое соединение перед запросом. DB_PGBOUNCER=true для
+# pgbouncer в режиме pool_mode=transaction: серверные курсоры
+# .iterator() не переживают смену серверного соединения.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'foodgram.db',
         'NAME': os.getenv('POSTGRES_DB', 'postgres'),
         'USER': os.getenv('POSTGRES_USER', 'postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', ''),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': (
+            os.getenv('DB_CONN_HEALTH_CHECKS', 'true').lower() == 'true'),
+        'DISABLE_SERVER_SIDE_CURSORS': (
+            os.getenv('DB_PGBOUNCER', 'false').lower() == 'true'),
     }
 }
 
+# Реплики для чтения: DB_REPLICAS=host1[:port],host2[:port] с теми же
+# базой и пользователем. GET-запросы к API читают с реплик, после записи
+# клиент DATABASE_REPLICA_STICKY секунд читает из основной базы,
+# недоступная реплика пропускается DATABASE_REPLICA_RETRY секунд.
+DATABASE_REPLICAS = []
+for number, address in enumerate(
+        filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1):
+    host, _, port = address.strip().partition(':')
+    DATABASE_REPLICAS.append(f'replica{number}')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_REPLICA_STICKY = int(os.getenv('DB_REPLICA_STICKY', 5))
+DATABASE_REPLICA_RETRY = int(os.getenv('DB_REPLICA_RETRY', 30))
+if DATABASE_REPLICAS:
+    DATABASE_ROUTERS = ['foodgram.db.router.ReplicaRouter']
+    MIDDLEWARE.append('api.middleware.ReplicaRoutingMiddleware')
+
+# По умолчанию кэш в памяти процесса, он годится только для одного
+# воркера. Для нескольких воркеров нужен общий кэш, например
+# django.core.cache.backends.memcached.PyMemcacheCache и адрес memcached
+# в CACHE_LOCATION (так настроен infra/docker-compose.yml).
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND',
+                             'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Кэш ответа GET /api/recipes/{id}/ (api/detail_cache.py). Версии рецептов
+# хранятся в CACHES, и с кэшем в памяти процесса сброс в одном воркере
+# не виден в остальных, поэтому без общего кэша он не включается.
+RECIPE_DETAIL_CACHE = (
+    'locmem' not in CACHES['default']['BACKEND'].lower()
+    and os.getenv('RECIPE_DETAIL_CACHE', 'true').lower() == 'true'
+)
+
+# Нечёткий поиск ингредиентов, требует расширения pg_trgm.
+INGREDIENT_TRIGRAM_SEARCH = (
+    os.getenv('INGREDIENT_TRIGRAM_SEARCH', 'false').lower() == 'true'
+)
+
+# Число потоков, создающих превью картинок рецептов.
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+
+# Рецепты авторов с большим числом подписчиков не рассылаются по лентам
+# при публикации, а дотягиваются при чтении ленты.
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 1000))
+
+# Кэш аутентификации по токену: имя общего кэша из CACHES, размер кэша
+# в памяти процесса и время жизни записи в секундах. Кэш в памяти
+# процесса сбрасывается только в своём воркере: в остальных токен после
+# выхода, смены пароля или деактивации действует ещё до TOKEN_CACHE_TTL
+# секунд, поэтому без общего кэша запись живёт всего несколько секунд.
+TOKEN_CACHE_BACKEND = os.getenv('TOKEN_CACHE_BACKEND', '')
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL',
+                                60 if TOKEN_CACHE_BACKEND else 5))
+
+# Асинхронные представления чтения рецептов, тегов и ингредиентов.
+# Включаются при запуске через ASGI (infra/gunicorn.conf.py, ASGI=true).
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'false').lower() == 'true'
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -115,7 +215,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachingTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
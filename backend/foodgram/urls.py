@@ -1,13 +1,18 @@
-# from django.conf import settings
 # from django.conf.urls.static import static
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 
+from api.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
 ]
 
+if settings.QUERY_METRICS:
+    urlpatterns.append(path('metrics', metrics_view, name='metrics'))
+
 # if settings.DEBUG:
 #     urlpatterns += static(settings.MEDIA_URL,
 #                           document_root=settings.MEDIA_ROOT)
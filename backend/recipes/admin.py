@@ -1,12 +1,20 @@
 from django.contrib import admin
 
 from recipes.models import (Ingredient, Tag, Recipe,
-                            Recipe_ingredient, Favorite, Shopping_cart)
+                            Recipe_ingredient, Favorite, Shopping_cart,
+                            ShoppingCartTotal, Timeline)
+
+
+@admin.register(Recipe)
+class RecipeAdmin(admin.ModelAdmin):
+    list_display = ('name', 'author', 'favorites_count', 'in_carts_count')
+    readonly_fields = ('favorites_count', 'in_carts_count')
 
 
 admin.site.register(Ingredient)
 admin.site.register(Tag)
-admin.site.register(Recipe)
 admin.site.register(Recipe_ingredient)
 admin.site.register(Favorite)
 admin.site.register(Shopping_cart)
+admin.site.register(ShoppingCartTotal)
+admin.site.register(Timeline)
@@ -0,0 +1,75 @@
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.dispatch import Signal
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZES = {  # Максимальная сторона превью в пикселях
+    'card': 480,
+    'detail': 1200,
+}
+THUMBNAIL_DIR = 'recipes/thumbs'
+
+# Отправляется с name картинки, когда для неё созданы новые превью.
+thumbnails_created = Signal()
+
+executor = ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS,
+                              thread_name_prefix='thumbnails')
+
+
+def thumbnail_name(name, variant):
+    """Имя файла превью картинки рецепта в формате WebP."""
+    base = posixpath.splitext(posixpath.basename(name))[0]
+    return f'{THUMBNAIL_DIR}/{base}_{variant}.webp'
+
+
+def make_thumbnails(name):
+    """Создаёт недостающие превью картинки рецепта."""
+    created = False
+    try:
+        with default_storage.open(name) as file:
+            image = ImageOps.exif_transpose(Image.open(file))
+            image = image.convert('RGBA' if 'A' in image.getbands()
+                                  else 'RGB')
+        for variant, size in THUMBNAIL_SIZES.items():
+            target = thumbnail_name(name, variant)
+            if default_storage.exists(target):
+                continue
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size))
+            buffer = BytesIO()
+            thumbnail.save(buffer, 'WEBP', quality=80)
+            default_storage.save(target, ContentFile(buffer.getvalue()))
+            created = True
+    except Exception:
+        logger.exception('Не удалось создать превью для %s', name)
+    if created:
+        thumbnails_created.send(sender=None, name=name)
+
+
+def make_thumbnails_task(name):
+    """make_thumbnails в потоке executor.
+
+    Получатели thumbnails_created обращаются к базе, поэтому соединение
+    потока проверяется и закрывается, как в начале и в конце запроса:
+    иначе оно жило бы дольше CONN_MAX_AGE и после разрыва.
+    """
+    close_old_connections()
+    try:
+        make_thumbnails(name)
+    finally:
+        close_old_connections()
+
+
+def schedule_thumbnails(name):
+    """Создаёт превью в фоновом потоке после фиксации транзакции."""
+    transaction.on_commit(
+        lambda: executor.submit(make_thumbnails_task, name))
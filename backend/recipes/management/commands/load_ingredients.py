@@ -0,0 +1,127 @@
+import csv
+import json
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.cache import bump_version
+from recipes.models import Ingredient
+
+DEFAULT_PATH = settings.BASE_DIR.parent / 'data' / 'ingredients.csv'
+
+
+def read_rows(path):
+    """Построчно читает пары (название, единица измерения)."""
+    with open(path, encoding='utf-8') as file:
+        if str(path).endswith('.json'):
+            for item in json.load(file):
+                yield item['name'], item['measurement_unit']
+        else:
+            for name, measurement_unit in csv.reader(file):
+                yield name, measurement_unit
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = dict(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class RowsFile:
+    """Файлоподобная обёртка над генератором строк для COPY."""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.writer = csv.writer(self)
+        self.buffer = ''
+
+    def write(self, value):
+        self.buffer += value
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.writer.writerow(row)
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV или JSON файла'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_PATH)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--no-copy', action='store_true',
+                            help='Не использовать COPY в PostgreSQL')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        rows = read_rows(options['path'])
+        try:
+            with transaction.atomic():
+                if (connection.vendor == 'postgresql'
+                        and not options['no_copy']):
+                    count = self.copy(rows)
+                else:
+                    count = self.bulk_upsert(rows, options['batch_size'])
+        except (OSError, KeyError, ValueError) as error:
+            raise CommandError(f'Не удалось прочитать файл: {error}')
+        bump_version('ingredients')
+        elapsed = max(time.monotonic() - start, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено строк: {count} за {elapsed:.2f} с '
+            f'({count / elapsed:.0f} строк/с)'
+        ))
+
+    def copy(self, rows):
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_staging '
+                '(name text, measurement_unit text) ON COMMIT DROP'
+            )
+            cursor.cursor.copy_expert(
+                'COPY ingredient_staging (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                RowsFile(rows)
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT ON (name) name, measurement_unit '
+                'FROM ingredient_staging '
+                'ON CONFLICT (name) DO UPDATE '
+                'SET measurement_unit = EXCLUDED.measurement_unit'
+            )
+            return cursor.rowcount
+
+    def bulk_upsert(self, rows, batch_size):
+        count = 0
+        for batch in batched(rows, batch_size):
+            existing = Ingredient.objects.in_bulk(batch, field_name='name')
+            changed = []
+            for name, ingredient in existing.items():
+                if ingredient.measurement_unit != batch[name]:
+                    ingredient.measurement_unit = batch[name]
+                    changed.append(ingredient)
+            Ingredient.objects.bulk_update(
+                changed, ['measurement_unit'], batch_size=batch_size)
+            Ingredient.objects.bulk_create(
+                [Ingredient(name=name, measurement_unit=measurement_unit)
+                 for name, measurement_unit in batch.items()
+                 if name not in existing],
+                batch_size=batch_size,
+                ignore_conflicts=True
+            )
+            count += len(batch)
+        return count
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import make_thumbnails
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создаёт недостающие превью картинок рецептов'
+
+    def handle(self, *args, **options):
+        names = (Recipe.objects.exclude(image='')
+                 .values_list('image', flat=True).distinct())
+        count = 0
+        for name in names.iterator():
+            make_thumbnails(name)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Обработано картинок: {count}'))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+
+from recipes.models import Recipe_ingredient, ShoppingCartTotal
+
+
+def live_totals():
+    """Итоги списков покупок, посчитанные по корзинам."""
+    return (
+        Recipe_ingredient.objects
+        .filter(recipe__shopping_recipe__isnull=False)
+        .values('recipe__shopping_recipe__user', 'ingredient')
+        .annotate(total=Sum('amount'))
+        .values_list('recipe__shopping_recipe__user', 'ingredient', 'total')
+    )
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает итоги списков покупок и сверяет их с корзинами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только сверить, не пересчитывая')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            self.rebuild(options['batch_size'])
+        expected = {(user, ingredient): total
+                    for user, ingredient, total in live_totals()}
+        stored = {(user, ingredient): total
+                  for user, ingredient, total in
+                  ShoppingCartTotal.objects.filter(
+                      total_amount__gt=0).values_list(
+                      'user', 'ingredient', 'total_amount')}
+        drift = {key for key in expected.keys() | stored.keys()
+                 if expected.get(key) != stored.get(key)}
+        if drift:
+            raise CommandError(f'Расхождений: {len(drift)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Итоги совпадают, строк: {len(stored)}'))
+
+    @transaction.atomic
+    def rebuild(self, batch_size):
+        ShoppingCartTotal.objects.all().delete()
+        batch = []
+        for user, ingredient, total in live_totals().iterator(
+                chunk_size=batch_size):
+            batch.append(ShoppingCartTotal(
+                user_id=user, ingredient_id=ingredient, total_amount=total))
+            if len(batch) >= batch_size:
+                ShoppingCartTotal.objects.bulk_create(batch)
+                batch = []
+        ShoppingCartTotal.objects.bulk_create(batch)
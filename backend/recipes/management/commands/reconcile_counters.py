@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, Shopping_cart
+from users.models import Subscribe, User
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', Shopping_cart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', Subscribe, 'author'),
+)
+
+
+def actual_count(related, field):
+    """Подзапрос, считающий связанные строки для каждой записи."""
+    return Coalesce(Subquery(
+        related.objects.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(count=Count('pk'))
+        .values('count')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Сверяет и исправляет денормализованные счётчики'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только сверить, не исправляя')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        for model, field, related, related_field in COUNTERS:
+            drifted = model.objects.annotate(
+                actual=actual_count(related, related_field)
+            ).exclude(**{field: F('actual')})
+            count = drifted.count()
+            if count and not options['check']:
+                model.objects.filter(pk__in=drifted.values('pk')).update(
+                    **{field: actual_count(related, related_field)})
+            self.stdout.write(
+                f'{model._meta.model_name}.{field}: расхождений {count}')
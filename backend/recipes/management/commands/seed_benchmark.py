@@ -0,0 +1,240 @@
+import random
+import time
+from io import BytesIO, StringIO
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from api.cache import bump_version
+from api.cookable import index
+from recipes.images import make_thumbnails
+from recipes.models import (FEED_BACKFILL, Favorite, Ingredient, Recipe,
+                            Recipe_ingredient, Shopping_cart, Tag, Timeline)
+from recipes.search import refresh_search_index
+from users.models import Subscribe, User
+
+USERNAME_PREFIX = 'bench'
+HEAVY_USERNAME = f'{USERNAME_PREFIX}-heavy'  # Пользователь с тысячами подписок
+PASSWORD = 'benchmark-password'  # Пароль всех сгенерированных пользователей
+IMAGE_NAME = 'recipes/benchmark.png'
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+DISHES = ('Суп', 'Салат', 'Пирог', 'Рагу', 'Омлет', 'Каша', 'Запеканка',
+          'Плов', 'Паста', 'Блины', 'Котлеты', 'Жаркое')
+ADJECTIVES = ('домашний', 'быстрый', 'праздничный', 'летний', 'острый',
+              'сытный', 'лёгкий', 'бабушкин', 'овощной', 'сливочный')
+FIRST_NAMES = ('Анна', 'Иван', 'Мария', 'Пётр', 'Ольга', 'Сергей')
+LAST_NAMES = ('Иванова', 'Петров', 'Сидорова', 'Смирнов', 'Кузнецова')
+
+
+def batched(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def popularity(count):
+    """Накопленные веса 1/ранг: первые элементы выбираются чаще."""
+    return list(accumulate(1 / rank for rank in range(1, count + 1)))
+
+
+def popular_sample(population, cum_weights, count):
+    """Случайная выборка без повторов, смещённая к популярным."""
+    count = min(count, len(population))
+    chosen = set()
+    while len(chosen) < count:
+        chosen.update(random.choices(population, cum_weights=cum_weights,
+                                     k=count - len(chosen)))
+    return chosen
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими данными для бенчмарков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='Подписок на пользователя')
+        parser.add_argument('--heavy-subscriptions', type=int, default=5000,
+                            help=f'Подписок у пользователя {HEAVY_USERNAME}, '
+                                 f'не больше числа пользователей')
+        parser.add_argument('--favorites', type=int, default=10,
+                            help='Избранных рецептов на пользователя')
+        parser.add_argument('--cart', type=int, default=3,
+                            help='Рецептов в списке покупок пользователя')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--clear', action='store_true',
+                            help='Удалить данные прошлого запуска')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        self.batch_size = options['batch_size']
+        start = time.monotonic()
+        bench_users = User.objects.filter(
+            username__startswith=USERNAME_PREFIX)
+        if options['clear']:
+            bench_users.delete()
+        elif bench_users.exists():
+            raise CommandError(
+                'Данные бенчмарка уже есть, используйте --clear.')
+        if options['users'] < 1:
+            raise CommandError('Нужен хотя бы один пользователь.')
+        if Ingredient.objects.count() < 50:
+            call_command('load_ingredients', stdout=StringIO())
+        with transaction.atomic():
+            users = self.create_users(options['users'])
+            recipes = self.create_recipes(users, options['recipes'])
+            self.create_relations(users, recipes, options)
+        self.refresh_denormalized()
+        self.stdout.write(self.style.SUCCESS(
+            f'Пользователей: {len(users)}, рецептов: {len(recipes)} '
+            f'за {time.monotonic() - start:.1f} с; '
+            f'пароль пользователей: {PASSWORD}'
+        ))
+
+    def bulk_create(self, model, objects):
+        for batch in batched(objects, self.batch_size):
+            model.objects.bulk_create(batch)
+
+    def create_users(self, count):
+        password = make_password(PASSWORD)
+        self.bulk_create(User, [
+            User(username=f'{USERNAME_PREFIX}{number}',
+                 email=f'{USERNAME_PREFIX}{number}@example.com',
+                 first_name=random.choice(FIRST_NAMES),
+                 last_name=random.choice(LAST_NAMES),
+                 password=password)
+            for number in range(count)
+        ])
+        users = list(User.objects.filter(
+            username__startswith=USERNAME_PREFIX
+        ).order_by('pk').values_list('pk', flat=True))
+        self.bulk_create(Token, [
+            Token(user_id=pk, key=Token.generate_key()) for pk in users])
+        return users
+
+    def create_image(self):
+        image = Image.new('RGB', (1200, 800), (226, 108, 45))
+        buffer = BytesIO()
+        image.save(buffer, 'PNG')
+        if not default_storage.exists(IMAGE_NAME):
+            default_storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+        make_thumbnails(IMAGE_NAME)
+        return image.size
+
+    def create_recipes(self, users, count):
+        width, height = self.create_image()
+        last = Recipe.objects.order_by('-pk').values_list(
+            'pk', flat=True).first() or 0
+        # Немногие авторы публикуют большую часть рецептов.
+        authors = popularity(len(users))
+        for batch in batched(range(count), self.batch_size):
+            Recipe.objects.bulk_create([
+                Recipe(author_id=author,
+                       name=(f'{random.choice(DISHES)} '
+                             f'{random.choice(ADJECTIVES)} {number}'),
+                       text=' '.join(random.choices(
+                           ADJECTIVES + DISHES, k=20)),
+                       cooking_time=random.randint(5, 180),
+                       image=IMAGE_NAME,
+                       image_width=width,
+                       image_height=height)
+                for number, author in zip(batch, random.choices(
+                    users, cum_weights=authors, k=len(batch)))
+            ])
+        return list(Recipe.objects.filter(pk__gt=last).order_by(
+            'pk').values_list('pk', 'author', 'pub_date'))
+
+    def create_relations(self, users, recipes, options):
+        ingredients = list(Ingredient.objects.values_list('pk', flat=True))
+        # Частые ингредиенты (соль, лук) встречаются в рецептах чаще.
+        common = popularity(len(ingredients))
+        tags = [Tag.objects.get_or_create(
+            slug=slug, defaults={'name': name, 'color': color})[0].pk
+            for name, color, slug in TAGS]
+        for batch in batched(recipes, self.batch_size):
+            recipe_ingredients = []
+            recipe_tags = []
+            for pk, _, _ in batch:
+                for ingredient in popular_sample(
+                        ingredients, common, random.randint(3, 12)):
+                    recipe_ingredients.append(Recipe_ingredient(
+                        recipe_id=pk, ingredient_id=ingredient,
+                        amount=random.randint(1, 500)))
+                for tag in random.sample(tags, random.randint(1, 2)):
+                    recipe_tags.append(Recipe.tags.through(
+                        recipe_id=pk, tag_id=tag))
+            self.bulk_create(Recipe_ingredient, recipe_ingredients)
+            self.bulk_create(Recipe.tags.through, recipe_tags)
+
+        recipe_ids = [pk for pk, _, _ in recipes]
+        popular_recipes = popularity(len(recipe_ids))
+        popular_authors = popularity(len(users))
+        by_author = {}
+        for pk, author, pub_date in reversed(recipes):
+            by_author.setdefault(author, []).append((pk, pub_date))
+        for batch in batched(users, max(1, self.batch_size // 100)):
+            subscriptions, favorites, carts, timelines = [], [], [], []
+            for user in batch:
+                authors = popular_sample(users, popular_authors,
+                                         options['subscriptions'] + 1)
+                authors.discard(user)
+                for author in list(authors)[:options['subscriptions']]:
+                    subscriptions.append(Subscribe(user_id=user,
+                                                   author_id=author))
+                    timelines.extend(
+                        Timeline(user_id=user, recipe_id=pk,
+                                 pub_date=pub_date)
+                        for pk, pub_date in
+                        by_author.get(author, [])[:FEED_BACKFILL])
+                favorites.extend(
+                    Favorite(user_id=user, recipe_id=pk)
+                    for pk in popular_sample(recipe_ids, popular_recipes,
+                                             options['favorites']))
+                carts.extend(
+                    Shopping_cart(user_id=user, recipe_id=pk)
+                    for pk in random.sample(
+                        recipe_ids, min(options['cart'], len(recipe_ids))))
+            self.bulk_create(Subscribe, subscriptions)
+            self.bulk_create(Timeline, timelines)
+            self.bulk_create(Favorite, favorites)
+            self.bulk_create(Shopping_cart, carts)
+        self.create_heavy_subscriber(users, by_author,
+                                     options['heavy_subscriptions'])
+
+    def create_heavy_subscriber(self, users, by_author, count):
+        """Пользователь, подписанный на count авторов, для нагрузочных
+        сценариев ленты и подписок."""
+        user = User.objects.create_user(
+            username=HEAVY_USERNAME, email=f'{HEAVY_USERNAME}@example.com',
+            password=PASSWORD)
+        Token.objects.create(user=user)
+        authors = random.sample(users, min(count, len(users)))
+        self.bulk_create(Subscribe, [
+            Subscribe(user=user, author_id=author) for author in authors])
+        self.bulk_create(Timeline, [
+            Timeline(user=user, recipe_id=pk, pub_date=pub_date)
+            for author in authors
+            for pk, pub_date in by_author.get(author, [])[:FEED_BACKFILL]])
+
+    def refresh_denormalized(self):
+        """bulk_create не вызывает сигналы, поэтому всё
+        денормализованное пересчитывается целиком."""
+        call_command('reconcile_counters', stdout=StringIO())
+        call_command('rebuild_cart_totals', stdout=StringIO(),
+                     stderr=StringIO(), batch_size=self.batch_size)
+        refresh_search_index()
+        for name in ('tags', 'ingredients'):
+            bump_version(name)
+        index.invalidate()
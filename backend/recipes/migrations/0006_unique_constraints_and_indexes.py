@@ -0,0 +1,59 @@
+# Generated by Django 3.2.3 on 2026-10-18 19:43
+
+from django.db import migrations, models
+from django.db.models import Min, Sum
+
+
+def delete_duplicates(model):
+    keep = (model.objects.values('user', 'recipe')
+            .annotate(keep=Min('id')).values('keep'))
+    return model.objects.exclude(id__in=keep).delete()[0]
+
+
+def remove_duplicates(apps, schema_editor):
+    delete_duplicates(apps.get_model('recipes', 'Favorite'))
+    if not delete_duplicates(apps.get_model('recipes', 'Shopping_cart')):
+        return
+    Recipe_ingredient = apps.get_model('recipes', 'Recipe_ingredient')
+    ShoppingCartTotal = apps.get_model('recipes', 'ShoppingCartTotal')
+    ShoppingCartTotal.objects.all().delete()
+    totals = (
+        Recipe_ingredient.objects
+        .filter(recipe__shopping_recipe__isnull=False)
+        .values('recipe__shopping_recipe__user', 'ingredient')
+        .annotate(total=Sum('amount'))
+        .values_list('recipe__shopping_recipe__user', 'ingredient', 'total')
+    )
+    ShoppingCartTotal.objects.bulk_create(
+        [ShoppingCartTotal(user_id=user, ingredient_id=ingredient,
+                           total_amount=total)
+         for user, ingredient, total in totals],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_ingredient_name_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['name', 'id'], name='recipe_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-pub_date', '-id'], name='recipe_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_favorite'),
+        ),
+        migrations.AddConstraint(
+            model_name='shopping_cart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_shopping_cart'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.3 on 2026-10-18 21:10
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+from PIL import Image
+
+
+def fill_image_size(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    names = (Recipe.objects.exclude(image='')
+             .values_list('image', flat=True).distinct())
+    for name in names.iterator():
+        try:
+            with default_storage.open(name) as file:
+                width, height = Image.open(file).size
+        except (OSError, ValueError):
+            continue
+        Recipe.objects.filter(image=name).update(
+            image_width=width, image_height=height)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_tags_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Высота картинки'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Ширина картинки'),
+        ),
+        migrations.RunPython(fill_image_size, migrations.RunPython.noop),
+    ]
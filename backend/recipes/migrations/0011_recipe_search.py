@@ -0,0 +1,67 @@
+# Generated by Django 3.2.3 on 2026-10-18 19:54
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# SQL на момент миграции; recipes.search может меняться позже.
+FTS_TABLE = 'recipes_recipe_fts'
+INGREDIENT_NAMES = (
+    '(SELECT {aggregate}(i.name, \' \') '
+    'FROM recipes_recipe_ingredient ri '
+    'JOIN recipes_ingredient i ON i.id = ri.ingredient_id '
+    'WHERE ri.recipe_id = r.id)'
+)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector '
+            'ON recipes_recipe USING gin (search_vector)'
+        )
+        names = INGREDIENT_NAMES.format(aggregate='string_agg')
+        schema_editor.execute(
+            'UPDATE recipes_recipe AS r SET search_vector = '
+            'setweight(to_tsvector(%s, coalesce(r.name, \'\')), \'A\') '
+            f'|| setweight(to_tsvector(%s, coalesce({names}, \'\')), '
+            '\'B\') '
+            '|| setweight(to_tsvector(%s, coalesce(r.text, \'\')), \'C\')',
+            ['russian'] * 3
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+            'USING fts5(name, ingredients, text)'
+        )
+        names = INGREDIENT_NAMES.format(aggregate='group_concat')
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text) '
+            f'SELECT r.id, r.name, coalesce({names}, \'\'), r.text '
+            'FROM recipes_recipe AS r'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'DROP INDEX IF EXISTS recipes_recipe_search_vector')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_timeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый индекс'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,4 +1,7 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import Case, F, OuterRef, Subquery, Sum, When
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 from users.models import User
@@ -6,6 +9,8 @@ from users.models import User
 
 MIN_MEANING = 1  # Минимальное значение для валидации
 MAX_MEANING = 32000  # Максимальное значение для валидации
+FEED_BACKFILL = 100  # Сколько рецептов автора добавлять в ленту при подписке
+FEED_BATCH_SIZE = 1000  # Размер пачки при рассылке рецепта по лентам
 
 
 class Tag(models.Model):
@@ -42,7 +47,7 @@ class Ingredient(models.Model):
     )
     measurement_unit = models.CharField(
         'Единицы измерения',
-        max_length=7,
+        max_length=200,
     )
 
     class Meta:
@@ -75,6 +80,16 @@ class Recipe(models.Model):
         upload_to='recipes/',
         blank=True
     )
+    image_width = models.PositiveIntegerField(
+        'Ширина картинки',
+        null=True,
+        blank=True
+    )
+    image_height = models.PositiveIntegerField(
+        'Высота картинки',
+        null=True,
+        blank=True
+    )
     name = models.CharField(
         'Название',
         max_length=200,
@@ -93,11 +108,32 @@ class Recipe(models.Model):
         'Дата публикации',
         auto_now_add=True
     )
+    favorites_count = models.PositiveIntegerField(
+        'Добавлений в избранное',
+        default=0
+    )
+    in_carts_count = models.PositiveIntegerField(
+        'Добавлений в список покупок',
+        default=0
+    )
+    search_vector = SearchVectorField(
+        'Поисковый индекс',
+        null=True,
+        editable=False
+    )
 
     class Meta:
         ordering = ['name']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['name', 'id'], name='recipe_name_idx'),
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_idx'),
+            # Превью рецептов автора в подписках: первые N по названию.
+            models.Index(fields=['author', 'name', 'id'],
+                         name='recipe_author_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -149,6 +185,12 @@ class Favorite(models.Model):
     class Meta:
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранные'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_favorite'
+            )
+        ]
 
     def __str__(self):
         return f'{self.user.username} добавил в избранное {self.recipe.name}'
@@ -171,6 +213,193 @@ class Shopping_cart(models.Model):
     class Meta:
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Список покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_shopping_cart'
+            )
+        ]
 
     def __str__(self):
         return f'{self.user.username} добавил в покупки {self.recipe.name}'
+
+
+class ShoppingCartTotalManager(models.Manager):
+
+    def recipe_amounts(self, recipe, sign=1):
+        """Количество каждого ингредиента в рецепте."""
+        return {
+            pk: sign * amount for pk, amount in (
+                Recipe_ingredient.objects.filter(recipe=recipe)
+                .values('ingredient')
+                .annotate(total=Sum('amount'))
+                .values_list('ingredient', 'total')
+            )
+        }
+
+    def apply(self, user_ids, amounts):
+        """Прибавляет amounts {id ингредиента: количество} к итогам.
+
+        Недостающие строки вставляются с нулём без конфликтов, затем все
+        строки меняются одним UPDATE: параллельные добавления в корзину
+        с общими ингредиентами не падают на unique_cart_total. Строки
+        с нулём не удаляются, иначе удаление в одной транзакции могло бы
+        потерять прибавку другой; их не видно в списке покупок,
+        а убирает rebuild_cart_totals.
+        """
+        amounts = {pk: amount for pk, amount in amounts.items() if amount}
+        if not amounts:
+            return
+        user_ids = set(user_ids)
+        if not user_ids:
+            return
+        self.bulk_create([
+            self.model(user_id=user_id, ingredient_id=pk, total_amount=0)
+            for user_id in user_ids
+            for pk in amounts
+        ], ignore_conflicts=True)
+        self.filter(user__in=user_ids, ingredient__in=amounts).update(
+            total_amount=F('total_amount') + Case(
+                *[When(ingredient=pk, then=amount)
+                  for pk, amount in amounts.items()],
+                output_field=models.IntegerField()
+            ))
+
+
+class ShoppingCartTotal(models.Model):
+    """Суммарное количество ингредиента в списке покупок пользователя."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='cart_totals',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='cart_totals',
+        verbose_name='Ингредиент'
+    )
+    total_amount = models.IntegerField(
+        'Общее количество',
+        default=0
+    )
+
+    objects = ShoppingCartTotalManager()
+
+    class Meta:
+        verbose_name = 'Итог списка покупок'
+        verbose_name_plural = 'Итоги списков покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_cart_total'
+            )
+        ]
+
+    def __str__(self):
+        return (f'{self.ingredient.name} - {self.total_amount} '
+                f'у {self.user.username}')
+
+
+class TimelineManager(models.Manager):
+
+    def fan_out(self, recipe):
+        """Fan-out on write: добавляет рецепт в ленты подписчиков."""
+        followers = recipe.author.subscribing.values_list('user', flat=True)
+        self.bulk_create(
+            (self.model(user_id=user_id, recipe=recipe,
+                        pub_date=recipe.pub_date)
+             for user_id in followers.iterator()),
+            batch_size=FEED_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+
+    def backfill(self, user, author, since=None):
+        """Добавляет в ленту последние рецепты автора."""
+        recipes = Recipe.objects.filter(author=author).order_by(
+            '-pub_date', '-id')
+        if since is not None:
+            recipes = recipes.filter(pub_date__gt=since)
+        self.bulk_create(
+            [self.model(user=user, recipe_id=pk, pub_date=pub_date)
+             for pk, pub_date in
+             recipes.values_list('pk', 'pub_date')[:FEED_BACKFILL]],
+            ignore_conflicts=True
+        )
+
+    def pull(self, user):
+        """Fan-out on read: дотягивает в ленту новые рецепты авторов,
+        у которых слишком много подписчиков для рассылки при записи."""
+        latest = self.filter(
+            user=user, recipe__author=OuterRef('pk')
+        ).order_by('-pub_date').values('pub_date')[:1]
+        authors = User.objects.filter(
+            subscribing__user=user,
+            subscribers_count__gt=settings.FEED_FANOUT_LIMIT
+        ).annotate(since=Subquery(latest)).values_list('pk', 'since')
+        for author, since in authors:
+            self.backfill(user, author, since)
+
+
+class Timeline(models.Model):
+    """Лента рецептов авторов, на которых подписан пользователь."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Рецепт'
+    )
+    pub_date = models.DateTimeField(
+        'Дата публикации рецепта'
+    )
+
+    objects = TimelineManager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_timeline'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='timeline_user_date_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.recipe.name} в ленте {self.user.username}'
+
+
+class RecipeSearchIndex(models.Model):
+    """Строка полнотекстового индекса рецептов в SQLite (FTS5).
+
+    Таблица создаётся миграцией 0011 и заполняется recipes.search;
+    модель нужна, чтобы соединить её с рецептами в одном запросе.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column='rowid',
+        db_constraint=False,
+        related_name='search_index'
+    )
+
+    class Meta:
+        managed = False
+        db_table = 'recipes_recipe_fts'
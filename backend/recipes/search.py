@@ -0,0 +1,98 @@
+"""Полнотекстовый поиск рецептов.
+
+В PostgreSQL рецепт индексируется в столбце search_vector с индексом
+GIN, в SQLite — в виртуальной таблице FTS5. Название весит больше
+ингредиентов, ингредиенты — больше описания.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection, connections
+from django.db.models import (BooleanField, Exists, F, FloatField, OuterRef,
+                              Q)
+from django.db.models.expressions import RawSQL
+
+from recipes.models import Recipe_ingredient, RecipeSearchIndex
+
+SEARCH_CONFIG = 'russian'  # Конфигурация полнотекстового поиска PostgreSQL
+FTS_TABLE = RecipeSearchIndex._meta.db_table
+FTS_WEIGHTS = '10.0, 5.0, 1.0'  # Веса bm25: название, ингредиенты, описание
+
+INGREDIENT_NAMES = (
+    '(SELECT {aggregate}(i.name, \' \') '
+    'FROM recipes_recipe_ingredient ri '
+    'JOIN recipes_ingredient i ON i.id = ri.ingredient_id '
+    'WHERE ri.recipe_id = r.id)'
+)
+
+
+def refresh_search_index(ids=None, using=connection):
+    """Пересчитывает поисковый индекс рецептов ids или всех рецептов."""
+    with using.cursor() as cursor:
+        if using.vendor == 'postgresql':
+            names = INGREDIENT_NAMES.format(aggregate='string_agg')
+            sql = (
+                'UPDATE recipes_recipe AS r SET search_vector = '
+                'setweight(to_tsvector(%s, coalesce(r.name, \'\')), \'A\') '
+                f'|| setweight(to_tsvector(%s, coalesce({names}, \'\')), '
+                '\'B\') '
+                '|| setweight(to_tsvector(%s, coalesce(r.text, \'\')), '
+                '\'C\')'
+            )
+            params = [SEARCH_CONFIG] * 3
+            if ids is not None:
+                sql += ' WHERE r.id = ANY(%s)'
+                params.append(list(ids))
+            cursor.execute(sql, params)
+        elif using.vendor == 'sqlite':
+            names = INGREDIENT_NAMES.format(aggregate='group_concat')
+            where, params = '', []
+            if ids is not None:
+                ids = list(ids)
+                if not ids:
+                    return
+                placeholders = ', '.join(['%s'] * len(ids))
+                where, params = f' WHERE {{}} IN ({placeholders})', ids
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE}' + where.format('rowid'), params)
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text) '
+                f'SELECT r.id, r.name, coalesce({names}, \'\'), r.text '
+                'FROM recipes_recipe AS r' + where.format('r.id'), params)
+
+
+def fts_query(value):
+    """Запрос FTS5 из слов поиска: все слова, с поиском по префиксу."""
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', value))
+
+
+def search_recipes(queryset, value):
+    """Рецепты, найденные по value, в порядке релевантности.
+
+    Релевантность добавляется в запрос как rank, поэтому поиск
+    сочетается с остальными фильтрами в одном запросе.
+    """
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        query = SearchQuery(value, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', 'name')
+    if vendor == 'sqlite':
+        match = fts_query(value)
+        if not match:
+            return queryset.none()
+        # Таблица FTS5 присоединяется к рецептам: MATCH выполняется один
+        # раз на запрос, а bm25 считается для каждой найденной строки.
+        return queryset.filter(search_index__isnull=False).filter(RawSQL(
+            f'{FTS_TABLE} MATCH %s', (match,), output_field=BooleanField()
+        )).annotate(rank=RawSQL(
+            f'-bm25({FTS_TABLE}, {FTS_WEIGHTS})', (),
+            output_field=FloatField()
+        )).order_by('-rank', 'name')
+    return queryset.filter(
+        Q(name__icontains=value) | Q(text__icontains=value)
+        | Exists(Recipe_ingredient.objects.filter(
+            recipe=OuterRef('pk'), ingredient__name__icontains=value))
+    )
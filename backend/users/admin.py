@@ -2,5 +2,11 @@ from django.contrib import admin
 
 from users.models import User, Subscribe
 
-admin.site.register(User)
+
+@admin.register(User)
+class UserAdmin(admin.ModelAdmin):
+    list_display = ('username', 'email', 'recipes_count', 'subscribers_count')
+    readonly_fields = ('recipes_count', 'subscribers_count')
+
+
 admin.site.register(Subscribe)
@@ -6,6 +6,8 @@ class User(AbstractUser):
     """Кастомный класс пользователя."""
 
     email = models.EmailField('email', max_length=254, unique=True)
+    recipes_count = models.PositiveIntegerField('Рецептов', default=0)
+    subscribers_count = models.PositiveIntegerField('Подписчиков', default=0)
 
     class Meta:
         ordering = ['id']
@@ -35,6 +37,12 @@ class Subscribe(models.Model):
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'author'],
+                name='unique_subscribe'
+            )
+        ]
 
     def __str__(self):
         return f'{self.user.username} подписался на {self.author.username}'
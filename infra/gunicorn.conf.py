@@ -0,0 +1,30 @@
+# Настройки gunicorn, файл монтируется в /app и читается автоматически.
+# ASGI=true запускает воркеры uvicorn и асинхронные представления чтения,
+# иначе синхронные воркеры поверх WSGI.
+import multiprocessing
+import os
+
+ASGI = os.getenv('ASGI', 'false').lower() == 'true'
+CORES = multiprocessing.cpu_count()
+# Кэш в памяти процесса у каждого воркера свой: версии справочников,
+# рецептов и токенов, сброшенные в одном воркере, в остальных остаются
+# прежними. Без общего кэша (CACHE_BACKEND) по умолчанию один воркер.
+SHARED_CACHE = 'locmem' not in os.getenv('CACHE_BACKEND', 'locmem')
+
+bind = '0:8000'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+max_requests = 10000  # Перезапуск воркера против утечек памяти
+max_requests_jitter = 1000
+
+if ASGI:
+    wsgi_app = 'foodgram.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    # Один процесс на ядро: ожидание базы не блокирует цикл событий.
+    workers = int(os.getenv('GUNICORN_WORKERS',
+                             CORES if SHARED_CACHE else 1))
+    raw_env = ['ASYNC_VIEWS=true']
+else:
+    wsgi_app = 'foodgram.wsgi:application'
+    workers = int(os.getenv('GUNICORN_WORKERS',
+                             CORES * 2 + 1 if SHARED_CACHE else 1))